@@ -1,12 +1,96 @@
+import base64
+import json
+import os
+
 from aws_cdk import (
     Stack,
     aws_ec2 as ec2,
     aws_amazonmq as amazonmq,
+    aws_lambda as fn,
     aws_ssm as ssm,
+    custom_resources as custom_resources,
+    CustomResource,
+    Duration,
+    Fn,
     CfnOutput)
 
 from constructs import Construct
 
+from sizing import sizing_profile
+
+# rabbitmq.conf keys of the broker configuration, overridden key by key with rabbitmq_configuration
+RABBITMQ_CONFIGURATION_DEFAULTS = {
+    # Give a stuck consumer 30 minutes before its unacked messages go back to the queue
+    "consumer_timeout": "1800000",
+    "heartbeat": "60",
+}
+
+# Policy of every queue, overridden key by key with rabbitmq_queue_policy
+RABBITMQ_QUEUE_POLICY_DEFAULTS = {
+    # Classic queues page to disk instead of holding an order peak in memory (always on from 3.12)
+    "queue-mode": "lazy",
+    # Quorum queues dead letter a poison message instead of redelivering it forever
+    "delivery-limit": 20,
+}
+
+
+def rabbitmq_version(engine_version):
+    # 3.13 -> (3, 13), 3.10.10 -> (3, 10)
+    return tuple(int(part) for part in engine_version.split('.')[:2])
+
+
+def context_map(value):
+    # -c rabbitmq_configuration='{"heartbeat": "30"}' arrives as a string
+    if isinstance(value, str):
+        return json.loads(value) if value.strip() else {}
+    return value or {}
+
+
+def rabbitmq_configuration(overrides):
+    configuration = dict(RABBITMQ_CONFIGURATION_DEFAULTS)
+    configuration.update({key: str(value) for key, value in context_map(overrides).items()})
+
+    if int(configuration["consumer_timeout"]) < 60000:
+        raise ValueError("rabbitmq_configuration consumer_timeout can't be under 60000 ms")
+    if int(configuration["heartbeat"]) < 0:
+        raise ValueError("rabbitmq_configuration heartbeat can't be negative")
+
+    return "".join(key + " = " + value + "\n" for key, value in configuration.items())
+
+
+def rabbitmq_queue_policy(overrides):
+    policy = dict(RABBITMQ_QUEUE_POLICY_DEFAULTS)
+    policy.update(context_map(overrides))
+
+    if policy.get("queue-mode", "default") not in ["default", "lazy"]:
+        raise ValueError("rabbitmq_queue_policy queue-mode must be default or lazy")
+
+    return policy
+
+
+# Keys RabbitMQ accepts in an operator policy, which applies on top of the user policy of a queue
+# instead of competing with it
+RABBITMQ_OPERATOR_POLICY_KEYS = ["expires", "message-ttl", "max-length", "max-length-bytes",
+                                 "max-in-memory-length", "max-in-memory-bytes", "delivery-limit"]
+
+
+def rabbitmq_queue_policies(overrides, cluster):
+    # Returns the operator policy and the user policy. Only one user policy applies to a queue,
+    # and a cluster broker has the Amazon MQ HA policy on every queue, so there the keys an
+    # operator policy can't hold (queue-mode) are left out unless they were asked for explicitly
+    policy = rabbitmq_queue_policy(overrides)
+    operator_policy = {key: value for key, value in policy.items() if key in RABBITMQ_OPERATOR_POLICY_KEYS}
+    user_policy = {key: value for key, value in policy.items() if key not in RABBITMQ_OPERATOR_POLICY_KEYS}
+
+    if cluster:
+        conflicting = [key for key in user_policy if key in context_map(overrides)]
+        if conflicting:
+            raise ValueError("rabbitmq_queue_policy " + ",".join(conflicting) +
+                             " would replace the Amazon MQ HA policy of a cluster broker")
+        user_policy = {}
+
+    return operator_policy, user_policy
+
 '''
 AMQ Stack
 '''
@@ -16,6 +100,8 @@ class AmazonMQRabbitMQStack(Stack):
                  **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        size = sizing_profile(self)
+
         if (self.node.try_get_context("deploy_rabbitmq") == "True"):
 
             mq_group = ec2.SecurityGroup(self, 'mq_group', vpc=vpc)
@@ -65,48 +151,121 @@ class AmazonMQRabbitMQStack(Stack):
                                                         username=mq_username,
                                                         password=mq_password)
 
-            if (self.node.try_get_context("deploy_rabbitmq_as_cluster") == "True"):
+            engine_version = self.node.try_get_context("rabbitmq_engine_version")
+            default_queue_type = self.node.try_get_context("rabbitmq_default_queue_type")
+            if default_queue_type not in ["", "classic", "quorum"]:
+                raise ValueError("rabbitmq_default_queue_type must be classic, quorum or empty")
+            if default_queue_type == "quorum" and rabbitmq_version(engine_version) < (3, 13):
+                raise ValueError("rabbitmq_default_queue_type quorum needs rabbitmq_engine_version 3.13 or later")
+
+            # Amazon MQ only takes broker configurations from RabbitMQ 3.11
+            mq_configuration_id = None
+            if rabbitmq_version(engine_version) >= (3, 11):
+                mq_configuration = amazonmq.CfnConfiguration(
+                    self,
+                    'mq_configuration',
+                    name='eshopRabbitMQ',
+                    description='Event bus settings for eShop',
+                    engine_type='RABBITMQ',
+                    engine_version=engine_version,
+                    data=base64.b64encode(rabbitmq_configuration(
+                        self.node.try_get_context("rabbitmq_configuration")).encode()).decode())
 
-                if self.node.try_get_context("vpc_only_public") == "False":
-                    vpc_subnets = [vpc.private_subnets[1].subnet_id,
-                                   vpc.private_subnets[2].subnet_id]
-                else:
-                    vpc_subnets = [vpc.public_subnets[1].subnet_id,
-                                   vpc.public_subnets[2].subnet_id]
-
-                    mq_instance = amazonmq.CfnBroker(self, 'mq_instance',
-                                                     auto_minor_version_upgrade=False,
-                                                     broker_name='eshopRabbitMQ',
-                                                     deployment_mode='CLUSTER_MULTI_AZ',
-                                                     engine_type='RABBITMQ',
-                                                     engine_version='3.10.10',
-                                                     host_instance_type='mq.m5.large',
-                                                     publicly_accessible=rabbit_public_access,
-                                                     users=[mq_master],
-                                                     subnet_ids=vpc_subnets,
-                                                     security_groups=mq_security_groups,
-                                                     logs=amazonmq.CfnBroker.LogListProperty(
-                                                         general=True
-                                                     ))
+                mq_configuration_id = amazonmq.CfnBroker.ConfigurationIdProperty(
+                    id=mq_configuration.attr_id,
+                    revision=mq_configuration.attr_revision)
+            elif context_map(self.node.try_get_context("rabbitmq_configuration")):
+                raise ValueError("rabbitmq_configuration needs rabbitmq_engine_version 3.11 or later")
+
+            if self.node.try_get_context("vpc_only_public") == "False":
+                mq_subnets = vpc.private_subnets
+            else:
+                mq_subnets = vpc.public_subnets
 
+            if (self.node.try_get_context("deploy_rabbitmq_as_cluster") == "True"):
+                # The cluster was created in the second and third subnets, which the default of 2 keeps.
+                # 3 spreads the three nodes over every AZ, but changing the subnets replaces the broker,
+                # so an existing one needs a new rabbitmq_broker_name as well.
+                subnet_quantity = int(self.node.try_get_context("rabbitmq_cluster_subnet_quantity"))
+                if not 1 <= subnet_quantity <= min(3, len(mq_subnets)):
+                    raise ValueError("rabbitmq_cluster_subnet_quantity must be between 1 and " +
+                                     str(min(3, len(mq_subnets))))
+                vpc_subnets = [mq_subnets[(1 + index) % len(mq_subnets)].subnet_id
+                               for index in range(subnet_quantity)]
+                deployment_mode = 'CLUSTER_MULTI_AZ'
+                host_instance_type = size.rabbitmq_cluster_instance_type
             else:
+                vpc_subnets = [mq_subnets[1].subnet_id]
+                deployment_mode = 'SINGLE_INSTANCE'
+                host_instance_type = size.rabbitmq_instance_type
+
+            mq_instance = amazonmq.CfnBroker(self, 'mq_instance',
+                                             # Amazon MQ requires it from 3.13
+                                             auto_minor_version_upgrade=rabbitmq_version(
+                                                 engine_version) >= (3, 13),
+                                             broker_name=self.node.try_get_context("rabbitmq_broker_name"),
+                                             deployment_mode=deployment_mode,
+                                             engine_type='RABBITMQ',
+                                             engine_version=engine_version,
+                                             configuration=mq_configuration_id,
+                                             host_instance_type=host_instance_type,
+                                             publicly_accessible=rabbit_public_access,
+                                             users=[mq_master],
+                                             subnet_ids=vpc_subnets,
+                                             security_groups=mq_security_groups,
+                                             logs=amazonmq.CfnBroker.LogListProperty(
+                                                 general=True
+                                             ))
+
+            operator_policy, queue_policy = rabbitmq_queue_policies(
+                self.node.try_get_context("rabbitmq_queue_policy"),
+                deployment_mode == 'CLUSTER_MULTI_AZ')
+
+            mq_console_url = "https://" + mq_instance.attr_id + ".mq." + self.region + ".amazonaws.com"
+
+            CfnOutput(self, 'RabbitMQAmqpEndpoints',
+                      value=Fn.join(',', mq_instance.attr_amqp_endpoints),
+                      description='The AMQP endpoints of the RabbitMQ broker',
+                      export_name='RabbitMQAmqpEndpoints')
+
+            CfnOutput(self, 'RabbitMQConsoleUrl',
+                      value=mq_console_url,
+                      description='The management console of the RabbitMQ broker',
+                      export_name='RabbitMQConsoleUrl')
+
+            # Queue type, queue policies and channel limit through the management API
+            policies_function = fn.Function(
+                self,
+                'mq_policies_function',
+                runtime=fn.Runtime.PYTHON_3_12,
+                handler='index.handler',
+                code=fn.Code.from_asset(os.path.join(
+                    os.path.dirname(os.path.abspath(__file__)), 'rabbitmq_policies_lambda')),
+                timeout=Duration.minutes(1),
+                # A private broker is only reachable from inside the VPC
+                vpc=vpc if not rabbit_public_access else None,
+                vpc_subnets=ec2.SubnetSelection(
+                    subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS) if not rabbit_public_access else None)
+
+            if not rabbit_public_access:
+                mq_group.connections.allow_from(policies_function, ec2.Port.tcp(443),
+                                                'allow the policies custom resource to reach the RabbitMQ management API')
+
+            policies_provider = custom_resources.Provider(
+                self,
+                'mq_policies_provider',
+                on_event_handler=policies_function)
 
-                if self.node.try_get_context("vpc_only_public") == "False":
-                    vpc_subnets = [vpc.private_subnets[1].subnet_id]
-                else:
-                    vpc_subnets = [vpc.public_subnets[1].subnet_id]
-
-                    mq_instance = amazonmq.CfnBroker(self, 'mq_instance',
-                                                     auto_minor_version_upgrade=False,
-                                                     broker_name='eshopRabbitMQ',
-                                                     deployment_mode='SINGLE_INSTANCE',
-                                                     engine_type='RABBITMQ',
-                                                     engine_version='3.10.10',
-                                                     host_instance_type='mq.t3.micro',
-                                                     publicly_accessible=rabbit_public_access,
-                                                     users=[mq_master],
-                                                     subnet_ids=vpc_subnets,
-                                                     security_groups=mq_security_groups,
-                                                     logs=amazonmq.CfnBroker.LogListProperty(
-                                                         general=True
-                                                     ))
+            CustomResource(
+                self,
+                'mq_policies',
+                service_token=policies_provider.service_token,
+                properties={
+                    "ManagementUrl": mq_console_url,
+                    "Username": mq_username,
+                    "Password": mq_password,
+                    "DefaultQueueType": default_queue_type,
+                    "OperatorPolicy": json.dumps(operator_policy),
+                    "QueuePolicy": json.dumps(queue_policy),
+                    "MaxChannels": str(self.node.try_get_context("rabbitmq_max_channels")),
+                })
@@ -0,0 +1,110 @@
+"""
+Purpose
+
+Scale the read replicas of a DocumentDB cluster with the read load, since Application Auto Scaling
+doesn't support DocumentDB
+
+A scale out and a scale in alarm watch the CPU or the connections of the readers and a scheduled
+Lambda (docdb_replica_autoscaler_lambda) adds or removes one replica per run between the
+instances of the stack and max_instances. The added replicas aren't part of the stack, scale in
+to the minimum before deleting it.
+"""
+
+from aws_cdk import (
+    aws_cloudwatch as cloudwatch,
+    aws_docdb as docdb,
+    aws_events as events,
+    aws_events_targets as targets,
+    aws_iam as iam,
+    aws_lambda as fn,
+    Duration
+)
+import os
+
+from constructs import Construct
+
+REPLICA_AUTOSCALING_METRICS = ["CPUUtilization", "DatabaseConnections"]
+
+
+class DocDbReplicaAutoscaler(Construct):
+
+    def __init__(self, scope: Construct, id: str, cluster: docdb.DatabaseCluster,
+                 instance_type: str, min_instances: int, max_instances: int,
+                 metric_name: str, scale_out_threshold: float,
+                 scale_in_threshold: float) -> None:
+        super().__init__(scope, id)
+
+        if metric_name not in REPLICA_AUTOSCALING_METRICS:
+            raise ValueError("documentdb_replica_autoscaling_metric must be one of " +
+                             ",".join(REPLICA_AUTOSCALING_METRICS))
+        if scale_in_threshold >= scale_out_threshold:
+            raise ValueError("documentdb_replica_autoscaling_scale_in_threshold must be lower than " +
+                             "documentdb_replica_autoscaling_scale_out_threshold")
+        if max_instances < min_instances:
+            raise ValueError("documentdb_max_quantity can't be lower than documentdb_quantity")
+
+        # Average over the readers only, the writer load doesn't move with more replicas
+        reader_metric = cloudwatch.Metric(
+            namespace="AWS/DocDB",
+            metric_name=metric_name,
+            dimensions_map={
+                "DBClusterIdentifier": cluster.cluster_identifier,
+                "Role": "READER"
+            },
+            statistic="Average",
+            period=Duration.minutes(5))
+
+        scale_out_alarm = cloudwatch.Alarm(
+            self,
+            "ScaleOutAlarm",
+            metric=reader_metric,
+            threshold=scale_out_threshold,
+            evaluation_periods=2,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING)
+
+        # Slower to scale in than out, so a short lull doesn't drop a replica that is needed again
+        scale_in_alarm = cloudwatch.Alarm(
+            self,
+            "ScaleInAlarm",
+            metric=reader_metric,
+            threshold=scale_in_threshold,
+            evaluation_periods=3,
+            comparison_operator=cloudwatch.ComparisonOperator.LESS_THAN_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING)
+
+        autoscaler = fn.Function(
+            self,
+            "Function",
+            runtime=fn.Runtime.PYTHON_3_12,
+            handler="index.handler",
+            code=fn.Code.from_asset(os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), "docdb_replica_autoscaler_lambda")),
+            timeout=Duration.seconds(30),
+            environment={
+                "CLUSTER_IDENTIFIER": cluster.cluster_identifier,
+                "INSTANCE_CLASS": "db." + instance_type,
+                "MIN_INSTANCES": str(min_instances),
+                "MAX_INSTANCES": str(max_instances),
+                "SCALE_OUT_ALARM": scale_out_alarm.alarm_name,
+                "SCALE_IN_ALARM": scale_in_alarm.alarm_name,
+            })
+
+        # DocumentDB management calls are authorized with the rds actions
+        autoscaler.add_to_role_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["rds:DescribeDBClusters", "rds:DescribeDBInstances",
+                     "rds:CreateDBInstance", "rds:DeleteDBInstance"],
+            resources=["*"]
+        ))
+        autoscaler.add_to_role_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["cloudwatch:DescribeAlarms"],
+            resources=[scale_out_alarm.alarm_arn, scale_in_alarm.alarm_arn]
+        ))
+
+        events.Rule(
+            self,
+            "Schedule",
+            schedule=events.Schedule.rate(Duration.minutes(5)),
+            targets=[targets.LambdaFunction(autoscaler)])
@@ -0,0 +1,63 @@
+"""
+Purpose
+
+Add or remove one DocumentDB read replica depending on the state of the scale out and scale in
+alarms. Runs on a schedule so a load that stays high keeps adding replicas up to MAX_INSTANCES.
+
+Only the replicas created here (named AUTOSCALED_PREFIX<timestamp>) are ever removed, the
+instances of the CloudFormation stack stay as the minimum.
+"""
+
+import os
+import time
+
+import boto3
+
+docdb = boto3.client("docdb")
+cloudwatch = boto3.client("cloudwatch")
+
+CLUSTER_IDENTIFIER = os.environ["CLUSTER_IDENTIFIER"]
+INSTANCE_CLASS = os.environ["INSTANCE_CLASS"]
+MIN_INSTANCES = int(os.environ["MIN_INSTANCES"])
+MAX_INSTANCES = int(os.environ["MAX_INSTANCES"])
+SCALE_OUT_ALARM = os.environ["SCALE_OUT_ALARM"]
+SCALE_IN_ALARM = os.environ["SCALE_IN_ALARM"]
+AUTOSCALED_PREFIX = "eshop-docdb-autoscaled-"
+
+
+def handler(event, context):
+    alarms = cloudwatch.describe_alarms(AlarmNames=[SCALE_OUT_ALARM, SCALE_IN_ALARM])
+    alarm_states = {alarm["AlarmName"]: alarm["StateValue"]
+                    for alarm in alarms["MetricAlarms"]}
+
+    cluster = docdb.describe_db_clusters(
+        DBClusterIdentifier=CLUSTER_IDENTIFIER)["DBClusters"][0]
+    writers = [member["DBInstanceIdentifier"] for member in cluster["DBClusterMembers"]
+               if member["IsClusterWriter"]]
+    instances = docdb.describe_db_instances(
+        Filters=[{"Name": "db-cluster-id", "Values": [CLUSTER_IDENTIFIER]}])["DBInstances"]
+
+    # One step at a time, the previous replica has to be in service before the metrics mean anything
+    if any(instance["DBInstanceStatus"] != "available" for instance in instances):
+        return "waiting"
+
+    if alarm_states.get(SCALE_OUT_ALARM) == "ALARM":
+        if len(instances) >= MAX_INSTANCES:
+            return "at maximum"
+        identifier = AUTOSCALED_PREFIX + str(int(time.time()))
+        docdb.create_db_instance(DBInstanceIdentifier=identifier,
+                                 DBInstanceClass=INSTANCE_CLASS,
+                                 Engine="docdb",
+                                 DBClusterIdentifier=CLUSTER_IDENTIFIER)
+        return "added " + identifier
+
+    if alarm_states.get(SCALE_IN_ALARM) == "ALARM":
+        autoscaled = sorted(instance["DBInstanceIdentifier"] for instance in instances
+                            if instance["DBInstanceIdentifier"].startswith(AUTOSCALED_PREFIX) and
+                            instance["DBInstanceIdentifier"] not in writers)
+        if not autoscaled or len(instances) <= MIN_INSTANCES:
+            return "at minimum"
+        docdb.delete_db_instance(DBInstanceIdentifier=autoscaled[-1])
+        return "removed " + autoscaled[-1]
+
+    return "steady"
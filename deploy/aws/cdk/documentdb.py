@@ -1,10 +1,69 @@
+import json
+
 from aws_cdk import (
     Stack,
     aws_ec2 as ec2,
-    aws_docdb as docdb)
+    aws_docdb as docdb,
+    aws_docdbelastic as docdbelastic,
+    CfnOutput,
+    Token)
 
 from constructs import Construct
 
+from docdb_replica_autoscaler import DocDbReplicaAutoscaler
+from sizing import sizing_profile
+
+
+def documentdb_parameter_group_family(engine_version):
+    # 5.0.0 -> docdb5.0
+    return "docdb" + ".".join(engine_version.split('.')[:2])
+
+
+# Defaults for the Locations and Marketing collections, overridden key by key with the
+# documentdb_parameters context map
+DOCUMENTDB_PARAMETER_DEFAULTS = {
+    # The profiler logs are exported to CloudWatch, so actually profile the slow operations
+    "profiler": "enabled",
+    "profiler_threshold_ms": "100",
+    "profiler_sampling_rate": "1.0",
+    # The audit logs are exported to CloudWatch as well
+    "audit_logs": "enabled",
+    "ttl_monitor": "enabled",
+    # 3 hours of change stream history for the consumers to catch up after a restart
+    "change_stream_log_retention_duration": "10800",
+}
+
+
+# iopt1 is I/O-Optimized, no per-I/O charge and lower latency for I/O heavy workloads
+DOCUMENTDB_STORAGE_TYPES = ["standard", "iopt1"]
+
+# vCPUs per shard supported by Elastic Clusters
+DOCUMENTDB_ELASTIC_SHARD_CAPACITIES = [2, 4, 8, 16, 32, 64]
+
+
+def documentdb_parameters(overrides):
+    # -c documentdb_parameters='{"profiler_threshold_ms": "50"}' arrives as a string
+    if isinstance(overrides, str):
+        overrides = json.loads(overrides) if overrides.strip() else {}
+
+    parameters = dict(DOCUMENTDB_PARAMETER_DEFAULTS)
+    parameters.update({key: str(value) for key, value in (overrides or {}).items()})
+
+    for key in ["profiler", "audit_logs", "ttl_monitor"]:
+        if parameters[key] not in ["enabled", "disabled"]:
+            raise ValueError("documentdb_parameters " + key + " must be enabled or disabled")
+    if not 50 <= int(parameters["profiler_threshold_ms"]) <= 2147483646:
+        raise ValueError(
+            "documentdb_parameters profiler_threshold_ms must be between 50 and 2147483646")
+    if not 0.0 <= float(parameters["profiler_sampling_rate"]) <= 1.0:
+        raise ValueError(
+            "documentdb_parameters profiler_sampling_rate must be between 0.0 and 1.0")
+    if not 3600 <= int(parameters["change_stream_log_retention_duration"]) <= 604800:
+        raise ValueError(
+            "documentdb_parameters change_stream_log_retention_duration must be between 3600 and 604800 seconds")
+
+    return parameters
+
 
 class DocumentDbStack(Stack):
 
@@ -12,6 +71,8 @@ class DocumentDbStack(Stack):
                  **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        size = sizing_profile(self)
+
         if (self.node.try_get_context("deploy_documentdb") == "True"):
 
             db_security_group = ec2.SecurityGroup(
@@ -33,20 +94,136 @@ class DocumentDbStack(Stack):
                 vpc_subnet = ec2.SubnetSelection(
                     subnet_type=ec2.SubnetType.PUBLIC)
 
-            cluster = docdb.DatabaseCluster(self, "Database",
-                                            master_user=docdb.Login(
-                                                username="eshop",  # NOTE: 'admin' is reserved by DocumentDB
-                                                secret_name="/eshop/docdb/masteruser"
-                                            ),
-                                            instance_type=ec2.InstanceType.of(
-                                                ec2.InstanceClass.MEMORY5, ec2.InstanceSize.LARGE),
-                                            vpc_subnets=vpc_subnet,
-                                            vpc=vpc,
-                                            instances=self.node.try_get_context(
-                                                "documentdb_quantity"),
-                                            deletion_protection=False,
-                                            export_profiler_logs_to_cloud_watch=True,  # Enable sending profiler logs
-                                            export_audit_logs_to_cloud_watch=True,  # Enable sending audit logs
-                                            )
-
-            cluster.connections.add_security_group(db_security_group)
+            if self.node.try_get_context("deploy_documentdb_as_elastic") == "True":
+
+                # Elastic Clusters shard the collections so the writes scale out with the shards
+                if size.documentdb_elastic_shard_capacity not in DOCUMENTDB_ELASTIC_SHARD_CAPACITIES:
+                    raise ValueError("documentdb_elastic_shard_capacity must be one of " +
+                                     ",".join(str(capacity) for capacity in DOCUMENTDB_ELASTIC_SHARD_CAPACITIES))
+                if not 1 <= size.documentdb_elastic_shard_count <= 32:
+                    raise ValueError("documentdb_elastic_shard_count must be between 1 and 32")
+
+                elastic_secret = docdb.DatabaseSecret(
+                    self,
+                    "ElasticSecret",
+                    username="eshop",  # NOTE: 'admin' is reserved by DocumentDB
+                    secret_name="/eshop/docdb/masteruser")
+
+                elastic_cluster = docdbelastic.CfnCluster(
+                    self,
+                    "ElasticCluster",
+                    cluster_name="eshop-docdb-elastic",
+                    admin_user_name="eshop",
+                    admin_user_password=elastic_secret.secret_value_from_json(
+                        "password").unsafe_unwrap(),
+                    auth_type="PLAIN_TEXT",
+                    shard_count=size.documentdb_elastic_shard_count,
+                    shard_capacity=size.documentdb_elastic_shard_capacity,
+                    subnet_ids=vpc.select_subnets(
+                        subnet_type=vpc_subnet.subnet_type).subnet_ids,
+                    vpc_security_group_ids=[db_security_group.security_group_id])
+
+                CfnOutput(
+                    self,
+                    id="DocumentDbElasticEndpoint",
+                    value=elastic_cluster.attr_cluster_endpoint,
+                    description="The endpoint of the DocumentDB Elastic Cluster",
+                    export_name="DocumentDbElasticEndpoint"
+                )
+
+                CfnOutput(
+                    self,
+                    id="DocumentDbSecretArn",
+                    value=elastic_secret.secret_arn,
+                    description="The master user secret of DocumentDB",
+                    export_name="DocumentDbSecretArn"
+                )
+
+            else:
+
+                engine_version = self.node.try_get_context("documentdb_engine_version")
+
+                parameter_group = docdb.ClusterParameterGroup(
+                    self,
+                    "DocDBParameterGroup",
+                    family=documentdb_parameter_group_family(engine_version),
+                    description="Parameters for eShop DocumentDB",
+                    parameters=documentdb_parameters(
+                        self.node.try_get_context("documentdb_parameters")))
+
+                cluster = docdb.DatabaseCluster(self, "Database",
+                                                master_user=docdb.Login(
+                                                    username="eshop",  # NOTE: 'admin' is reserved by DocumentDB
+                                                    secret_name="/eshop/docdb/masteruser"
+                                                ),
+                                                instance_type=ec2.InstanceType(
+                                                    size.documentdb_instance_type),
+                                                vpc_subnets=vpc_subnet,
+                                                vpc=vpc,
+                                                instances=size.documentdb_quantity,
+                                                engine_version=engine_version,
+                                                parameter_group=parameter_group,
+                                                deletion_protection=False,
+                                                export_profiler_logs_to_cloud_watch=True,  # Enable sending profiler logs
+                                                export_audit_logs_to_cloud_watch=True,  # Enable sending audit logs
+                                                )
+
+                cluster.connections.add_security_group(db_security_group)
+
+                # DatabaseCluster has no storage type property in this CDK version
+                storage_type = self.node.try_get_context("documentdb_storage_type")
+                if storage_type not in DOCUMENTDB_STORAGE_TYPES:
+                    raise ValueError("documentdb_storage_type must be one of " +
+                                     ",".join(DOCUMENTDB_STORAGE_TYPES))
+                if storage_type == "iopt1":
+                    if int(engine_version.split('.')[0]) < 5:
+                        raise ValueError("documentdb_storage_type iopt1 needs documentdb_engine_version 5.0 or later")
+                    cluster.node.default_child.add_property_override("StorageType", storage_type)
+
+                if self.node.try_get_context("deploy_documentdb_replica_autoscaling") == "True":
+                    DocDbReplicaAutoscaler(
+                        self,
+                        "ReplicaAutoscaler",
+                        cluster=cluster,
+                        instance_type=size.documentdb_instance_type,
+                        min_instances=size.documentdb_quantity,
+                        max_instances=size.documentdb_max_quantity,
+                        metric_name=self.node.try_get_context(
+                            "documentdb_replica_autoscaling_metric"),
+                        scale_out_threshold=float(self.node.try_get_context(
+                            "documentdb_replica_autoscaling_scale_out_threshold")),
+                        scale_in_threshold=float(self.node.try_get_context(
+                            "documentdb_replica_autoscaling_scale_in_threshold")))
+
+                CfnOutput(
+                    self,
+                    id="DocumentDbEndpoint",
+                    value=cluster.cluster_endpoint.hostname,
+                    description="The writer endpoint of DocumentDB",
+                    export_name="DocumentDbEndpoint"
+                )
+
+                # With readPreference=secondaryPreferred the reads spread over the replicas
+                CfnOutput(
+                    self,
+                    id="DocumentDbReaderEndpoint",
+                    value=cluster.cluster_read_endpoint.hostname,
+                    description="The reader endpoint of DocumentDB",
+                    export_name="DocumentDbReaderEndpoint"
+                )
+
+                CfnOutput(
+                    self,
+                    id="DocumentDbPort",
+                    value=Token.as_string(cluster.cluster_endpoint.port),
+                    description="The port of DocumentDB",
+                    export_name="DocumentDbPort"
+                )
+
+                CfnOutput(
+                    self,
+                    id="DocumentDbSecretArn",
+                    value=cluster.secret.secret_arn,
+                    description="The master user secret of DocumentDB",
+                    export_name="DocumentDbSecretArn"
+                )
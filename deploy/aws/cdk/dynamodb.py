@@ -0,0 +1,180 @@
+import json
+
+from aws_cdk import (
+    Stack,
+    aws_dax as dax,
+    aws_dynamodb as dynamodb,
+    aws_ec2 as ec2,
+    aws_iam as iam,
+    CfnOutput,
+    RemovalPolicy)
+
+from constructs import Construct
+
+from sizing import sizing_profile
+
+# Table -> partition key, the items expire with the ExpiresAt TTL attribute (epoch seconds)
+DYNAMODB_TABLES = {
+    "basket": "BuyerId",
+    "session": "SessionId",
+}
+
+DYNAMODB_BILLING_MODES = ["PAY_PER_REQUEST", "PROVISIONED"]
+
+
+def dynamodb_global_secondary_indexes(indexes):
+    # -c dynamodb_global_secondary_indexes='{"basket": [{"name": "ByUpdatedAt", ...}]}' arrives as a string
+    if isinstance(indexes, str):
+        indexes = json.loads(indexes) if indexes.strip() else {}
+
+    for table, table_indexes in (indexes or {}).items():
+        if table not in DYNAMODB_TABLES:
+            raise ValueError("dynamodb_global_secondary_indexes table " + table +
+                             " is not one of " + ",".join(DYNAMODB_TABLES))
+        for index in table_indexes:
+            if "name" not in index or "partition_key" not in index:
+                raise ValueError("dynamodb_global_secondary_indexes of " + table +
+                                 " need a name and a partition_key")
+
+    return indexes or {}
+
+
+class DynamoDbStack(Stack):
+
+    def __init__(self, scope: Construct, construct_id: str, vpc: ec2.Vpc,
+                 **kwargs) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        size = sizing_profile(self)
+
+        if (self.node.try_get_context("deploy_dynamodb") == "True"):
+
+            billing_mode = self.node.try_get_context("dynamodb_billing_mode")
+            if billing_mode not in DYNAMODB_BILLING_MODES:
+                raise ValueError("dynamodb_billing_mode must be one of " +
+                                 ",".join(DYNAMODB_BILLING_MODES))
+            provisioned = billing_mode == "PROVISIONED"
+
+            target_utilization = int(self.node.try_get_context(
+                "dynamodb_autoscaling_target_utilization"))
+            if not 20 <= target_utilization <= 90:
+                raise ValueError(
+                    "dynamodb_autoscaling_target_utilization must be between 20 and 90")
+
+            indexes = dynamodb_global_secondary_indexes(
+                self.node.try_get_context("dynamodb_global_secondary_indexes"))
+
+            tables = []
+            for name, partition_key in DYNAMODB_TABLES.items():
+                table = dynamodb.Table(
+                    self,
+                    name.capitalize() + "Table",
+                    partition_key=dynamodb.Attribute(
+                        name=partition_key, type=dynamodb.AttributeType.STRING),
+                    billing_mode=dynamodb.BillingMode[billing_mode],
+                    read_capacity=size.dynamodb_read_capacity if provisioned else None,
+                    write_capacity=size.dynamodb_write_capacity if provisioned else None,
+                    time_to_live_attribute="ExpiresAt",
+                    removal_policy=RemovalPolicy.DESTROY)
+                tables.append(table)
+
+                for index in indexes.get(name, []):
+                    table.add_global_secondary_index(
+                        index_name=index["name"],
+                        partition_key=dynamodb.Attribute(
+                            name=index["partition_key"], type=dynamodb.AttributeType.STRING),
+                        sort_key=dynamodb.Attribute(
+                            name=index["sort_key"], type=dynamodb.AttributeType.STRING)
+                        if "sort_key" in index else None,
+                        read_capacity=size.dynamodb_read_capacity if provisioned else None,
+                        write_capacity=size.dynamodb_write_capacity if provisioned else None)
+
+                if provisioned:
+                    # Target tracking between the provisioned capacity and the max of the sizing profile
+                    table.auto_scale_read_capacity(
+                        min_capacity=size.dynamodb_read_capacity,
+                        max_capacity=size.dynamodb_max_read_capacity
+                    ).scale_on_utilization(target_utilization_percent=target_utilization)
+                    table.auto_scale_write_capacity(
+                        min_capacity=size.dynamodb_write_capacity,
+                        max_capacity=size.dynamodb_max_write_capacity
+                    ).scale_on_utilization(target_utilization_percent=target_utilization)
+
+                    for index in indexes.get(name, []):
+                        table.auto_scale_global_secondary_index_read_capacity(
+                            index["name"],
+                            min_capacity=size.dynamodb_read_capacity,
+                            max_capacity=size.dynamodb_max_read_capacity
+                        ).scale_on_utilization(target_utilization_percent=target_utilization)
+                        table.auto_scale_global_secondary_index_write_capacity(
+                            index["name"],
+                            min_capacity=size.dynamodb_write_capacity,
+                            max_capacity=size.dynamodb_max_write_capacity
+                        ).scale_on_utilization(target_utilization_percent=target_utilization)
+
+                CfnOutput(
+                    self,
+                    id="DynamoDb" + name.capitalize() + "TableName",
+                    value=table.table_name,
+                    description="The name of the DynamoDB " + name + " table",
+                    export_name="DynamoDb" + name.capitalize() + "TableName"
+                )
+
+            if self.node.try_get_context("deploy_dynamodb_dax") == "True":
+
+                dax_security_group = ec2.SecurityGroup(
+                    self, "DaxSecurityGroup", vpc=vpc, allow_all_outbound=True)
+
+                list_subnets = self.node.try_get_context(
+                    "vpc_cidr_dax_subnets").split(',')
+
+                for subnet in list_subnets:
+                    dax_security_group.add_ingress_rule(
+                        peer=ec2.Peer.ipv4(subnet),
+                        description="DAX with TLS",
+                        connection=ec2.Port.tcp(9111))
+
+                if self.node.try_get_context("vpc_only_public") == "False":
+                    vpc_subnet = ec2.SubnetSelection(
+                        subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS)
+                else:
+                    vpc_subnet = ec2.SubnetSelection(
+                        subnet_type=ec2.SubnetType.PUBLIC)
+
+                dax_subnet_group = dax.CfnSubnetGroup(
+                    self,
+                    "DaxSubnetGroup",
+                    subnet_group_name="eshop-dax",
+                    description="Subnet Group for DAX",
+                    subnet_ids=vpc.select_subnets(
+                        subnet_type=vpc_subnet.subnet_type).subnet_ids)
+
+                # The role DAX reads and writes the tables with on behalf of the clients
+                dax_role = iam.Role(
+                    self,
+                    "DaxRole",
+                    assumed_by=iam.ServicePrincipal("dax.amazonaws.com"))
+                for table in tables:
+                    table.grant_read_write_data(dax_role)
+
+                dax_cluster = dax.CfnCluster(
+                    self,
+                    "DaxCluster",
+                    cluster_name="eshop-dax",
+                    iam_role_arn=dax_role.role_arn,
+                    node_type=size.dynamodb_dax_node_type,
+                    replication_factor=size.dynamodb_dax_node_quantity,
+                    subnet_group_name=dax_subnet_group.ref,
+                    security_group_ids=[dax_security_group.security_group_id],
+                    sse_specification=dax.CfnCluster.SSESpecificationProperty(
+                        sse_enabled=True),
+                    cluster_endpoint_encryption_type="TLS")
+                dax_cluster.node.add_dependency(dax_role)
+
+                CfnOutput(
+                    self,
+                    id="DynamoDbDaxEndpoint",
+                    value=dax_cluster.attr_cluster_discovery_endpoint_url,
+                    description="The cluster discovery endpoint of DAX",
+                    export_name="DynamoDbDaxEndpoint"
+                )
@@ -10,16 +10,148 @@ NOTE: This pulls many parameters/options for what you'd like from the cdk.json c
 Have a look there for many options you can change to customise this template for your environments/needs.
 """
 
-from aws_cdk import (aws_ec2 as ec2, aws_eks as eks, aws_iam as iam,
+from aws_cdk import (CfnJson, Fn, aws_ec2 as ec2, aws_eks as eks, aws_iam as iam,
                      aws_opensearchservice as opensearch, aws_logs as logs,
                      aws_certificatemanager as cm, CfnOutput,
                      RemovalPolicy, Stack, aws_route53 as route53,
                      lambda_layer_kubectl_v28)
 from constructs import Construct
+import json
 import yaml
 
 from amp_custom_resource import AMPCustomResource
 from eks_worker_role_statements import EksWorkerRoleStatements
+from sizing import sizing_profile
+
+EKS_NODE_GROUP_SPEC_KEYS = ["capacity_type", "instance_types", "ami_type", "release_version", "labels",
+                            "taints", "min_size", "max_size", "desired_size", "disk_size", "priority"]
+
+
+def eks_node_group_specs(node_groups):
+    # -c eks_node_groups='{"ondemand": {"capacity_type": "ON_DEMAND"}}' arrives as a string
+    if isinstance(node_groups, str):
+        node_groups = json.loads(node_groups) if node_groups.strip() else {}
+
+    for name, spec in (node_groups or {}).items():
+        if not name.isalnum():
+            raise ValueError("eks_node_groups names must be alphanumeric, not " + name)
+        unknown = [key for key in spec if key not in EKS_NODE_GROUP_SPEC_KEYS]
+        if unknown:
+            raise ValueError("eks_node_groups " + name + " has unknown keys " +
+                             ",".join(unknown) + ", valid ones are " + ",".join(EKS_NODE_GROUP_SPEC_KEYS))
+        if spec.get("capacity_type", "ON_DEMAND") not in eks.CapacityType.__members__:
+            raise ValueError("eks_node_groups " + name + " capacity_type must be one of " +
+                             ",".join(eks.CapacityType.__members__))
+        if spec.get("ami_type", "AL2_X86_64") not in eks.NodegroupAmiType.__members__:
+            raise ValueError("eks_node_groups " + name + " ami_type must be one of " +
+                             ",".join(eks.NodegroupAmiType.__members__))
+        for taint in spec.get("taints", []):
+            if taint.get("effect") not in eks.TaintEffect.__members__:
+                raise ValueError("eks_node_groups " + name + " taint effects must be one of " +
+                                 ",".join(eks.TaintEffect.__members__))
+
+    return node_groups or {}
+
+
+# eks_node_architecture -> Kubernetes arch label and AMI type of the default node group
+EKS_NODE_ARCHITECTURES = {
+    "x86_64": ("amd64", "AL2_X86_64"),
+    "arm64": ("arm64", "AL2_ARM_64"),
+}
+
+
+def eks_node_architecture(scope):
+    architecture = scope.node.try_get_context("eks_node_architecture") or "x86_64"
+    if architecture not in EKS_NODE_ARCHITECTURES:
+        raise ValueError("eks_node_architecture must be one of " + ",".join(EKS_NODE_ARCHITECTURES))
+    return architecture
+
+
+def eks_instance_types(name, instance_types, arm, prefix_delegation=False):
+    # A Graviton instance type can't boot an x86 AMI and the other way around, catch it at synth time.
+    # The max pods of managed nodes come from EKS (see below), only the Nitro check applies to them.
+    if prefix_delegation:
+        eks_nitro_instance_types(name, instance_types)
+    architecture = ec2.InstanceArchitecture.ARM_64 if arm else ec2.InstanceArchitecture.X86_64
+    mismatched = [instance_type for instance_type in instance_types
+                  if ec2.InstanceType(instance_type).architecture != architecture]
+    if mismatched:
+        raise ValueError(name + " instance types " + ",".join(mismatched) + " are not " +
+                         ("arm64" if arm else "x86_64"))
+    return [ec2.InstanceType(instance_type) for instance_type in instance_types]
+
+
+# Prefix delegation with enough warm addresses for a burst of pods, overridden key by key with the
+# vpc_cni_env context map (https://github.com/aws/amazon-vpc-cni-k8s#cni-configuration-variables)
+VPC_CNI_ENV_DEFAULTS = {
+    "ENABLE_PREFIX_DELEGATION": "true",
+    # Keep one spare /28 prefix (16 addresses) attached so new pods don't wait on an EC2 call
+    "WARM_PREFIX_TARGET": "1",
+}
+
+VPC_CNI_WARM_TARGETS = ["WARM_PREFIX_TARGET", "WARM_IP_TARGET", "MINIMUM_IP_TARGET", "WARM_ENI_TARGET"]
+
+
+# Custom networking for deploy_vpc_pod_cidr, the ENIConfig of each node is the one named after its AZ
+VPC_CNI_CUSTOM_NETWORKING_ENV = {
+    "AWS_VPC_K8S_CNI_CUSTOM_NETWORK_CFG": "true",
+    "ENI_CONFIG_LABEL_DEF": "topology.kubernetes.io/zone",
+}
+
+
+def vpc_cni_env(overrides, custom_networking=False):
+    # -c vpc_cni_env='{"WARM_IP_TARGET": 5, "MINIMUM_IP_TARGET": 30}' arrives as a string
+    if isinstance(overrides, str):
+        overrides = json.loads(overrides) if overrides.strip() else {}
+
+    # The add-on configuration schema only takes strings
+    env = {**VPC_CNI_ENV_DEFAULTS, **(VPC_CNI_CUSTOM_NETWORKING_ENV if custom_networking else {}),
+           **{key: str(value) for key, value in (overrides or {}).items()}}
+    for key in VPC_CNI_WARM_TARGETS:
+        if key in env and not env[key].isdigit():
+            raise ValueError("vpc_cni_env " + key + " must be a non-negative integer")
+    if env["ENABLE_PREFIX_DELEGATION"] not in ["true", "false"]:
+        raise ValueError("vpc_cni_env ENABLE_PREFIX_DELEGATION must be true or false")
+
+    return env
+
+
+# Instance families without the Nitro hypervisor, they can't get prefixes attached
+EKS_NON_NITRO_FAMILIES = ["c1", "c3", "c4", "d2", "g2", "g3", "h1", "i2", "i3", "m1", "m2", "m3", "m4",
+                          "p2", "p3", "r3", "r4", "t1", "t2", "x1", "x1e"]
+
+# Sizes under 30 vCPUs, the max pods calculator caps them at 110 pods and the bigger ones at 250
+EKS_MAX_PODS_110_SIZES = ["small", "medium", "large", "xlarge", "2xlarge", "3xlarge", "4xlarge", "6xlarge"]
+
+
+def eks_nitro_instance_types(name, instance_types):
+    non_nitro = [instance_type for instance_type in instance_types
+                 if instance_type.split(".")[0] in EKS_NON_NITRO_FAMILIES]
+    if non_nitro:
+        raise ValueError(name + " instance types " + ",".join(non_nitro) +
+                         " aren't Nitro based, they don't support prefix delegation")
+
+
+def eks_max_pods(name, instance_types, custom_networking=False):
+    # The max pods of the Karpenter nodes with prefix delegation, the lowest of its instance types as
+    # a node can be any of them. Without prefix delegation the ENI limits of each instance type apply.
+    eks_nitro_instance_types(name, instance_types)
+
+    max_pods = []
+    for instance_type in instance_types:
+        size = instance_type.split(".")[1]
+        if size in ["nano", "micro"]:
+            # 2 ENIs with one secondary address slot each, 2 * 16 + 2, custom networking leaves
+            # the primary ENI to the node
+            max_pods.append(18 if custom_networking else 34)
+        else:
+            max_pods.append(110 if size in EKS_MAX_PODS_110_SIZES else 250)
+    return min(max_pods)
+
+
+def eks_node_group_name(name):
+    # The managed node group's ASG is named eks-<nodegroup name>-<uuid>, the priority expander matches on it
+    return "eks-node-group-" + name
 
 
 class EKSClusterStack(Stack):
@@ -28,6 +160,7 @@ class EKSClusterStack(Stack):
         super().__init__(scope, id, **kwargs)
 
         statement = EksWorkerRoleStatements()
+        size = sizing_profile(self)
 
         # Either create a new IAM role to administrate the cluster or create a new one
         if self.node.try_get_context(
@@ -138,6 +271,15 @@ class EKSClusterStack(Stack):
             export_name="EKSSGID",
         )
 
+        # The security group of the managed nodes, the pod ENIs of custom networking get it too
+        CfnOutput(
+            self,
+            "EKSClusterSecurityGroupId",
+            value=eks_cluster.cluster_security_group_id,
+            description="The EKS Cluster's security group ID",
+            export_name="EKSClusterSecurityGroupId",
+        )
+
         CfnOutput(
             self,
             id="EKSClusterOIDCProvider",
@@ -162,21 +304,69 @@ class EKSClusterStack(Stack):
             export_name="EKSClusterControlPlaneIAMRole",
         )
 
+        # Manage the vpc-cni add-on, with prefix delegation each ENI slot holds a /28 prefix instead
+        # of a single address so the small nodes fit more pods and pods start without waiting on IPs
+        vpc_cni_addon = None
+        prefix_delegation = False
+        if (self.node.try_get_context("deploy_vpc_pod_cidr") == "True"
+                and self.node.try_get_context("deploy_vpc_cni_addon") != "True"):
+            raise ValueError("deploy_vpc_pod_cidr configures custom networking through the vpc-cni add-on, "
+                             "it needs deploy_vpc_cni_addon set to True")
+        if self.node.try_get_context("deploy_vpc_cni_addon") == "True":
+            env = vpc_cni_env(self.node.try_get_context("vpc_cni_env"),
+                              self.node.try_get_context("deploy_vpc_pod_cidr") == "True")
+            prefix_delegation = env["ENABLE_PREFIX_DELEGATION"] == "true"
+
+            # IRSA for aws-node, so the CNI permissions don't have to stay on the worker role
+            vpc_cni_addon_role = iam.Role(
+                self,
+                'VpcCniAddonRole',
+                assumed_by=iam.FederatedPrincipal(
+                    federated=eks_cluster.open_id_connect_provider.
+                    open_id_connect_provider_arn,
+                    conditions={'StringEquals': CfnJson(
+                        self, 'JsonConditionaws-node',
+                        value={
+                            f'{eks_cluster.cluster_open_id_connect_issuer}:sub':
+                            'system:serviceaccount:kube-system:aws-node',
+                            f'{eks_cluster.cluster_open_id_connect_issuer}:aud': 'sts.amazonaws.com'
+                        })},
+                    assume_role_action='sts:AssumeRoleWithWebIdentity'
+                )
+            )
+            vpc_cni_addon_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name(
+                "AmazonEKS_CNI_Policy"))
+
+            configuration_values = {"env": env}
+            # vpc-cni custom networking, one ENIConfig per AZ (named after it, ENI_CONFIG_LABEL_DEF is the
+            # zone label) so the pods get their IPs from the pod subnets of the VPCStack secondary CIDR.
+            # The add-on creates them, so they exist before the node groups (which depend on it) launch.
+            if self.node.try_get_context("deploy_vpc_pod_cidr") == "True":
+                configuration_values["eniConfig"] = {
+                    "create": True,
+                    "region": self.region,
+                    "subnets": {
+                        private_subnet.availability_zone: {
+                            "id": Fn.import_value("VPCPodSubnet-" + private_subnet.availability_zone),
+                            "securityGroups": [eks_cluster.cluster_security_group_id],
+                        }
+                        for private_subnet in vpc.private_subnets
+                    },
+                }
+
+            vpc_cni_addon = eks.CfnAddon(
+                self,
+                "VpcCniAddon",
+                addon_name="vpc-cni",
+                cluster_name=eks_cluster.cluster_name,
+                resolve_conflicts="OVERWRITE",
+                addon_version=self.node.try_get_context("vpc_cni_addon_version"),
+                service_account_role_arn=vpc_cni_addon_role.role_arn,
+                configuration_values=json.dumps(configuration_values)
+            )
+
         # Add a Managed Node Group
         if self.node.try_get_context("eks_deploy_managed_nodegroup") == "True":
-            # If we enabled spot then use that
-            if self.node.try_get_context("eks_node_spot") == "True":
-                node_capacity_type = eks.CapacityType.SPOT
-                list_spot_instances = self.node.try_get_context(
-                    "eks_spot_node_instance_type").split(',')
-                instance_types = list(
-                    map(lambda x: ec2.InstanceType(x), list_spot_instances))
-            # Otherwise give us OnDemand
-            else:
-                node_capacity_type = eks.CapacityType.ON_DEMAND
-                instance_types = [ec2.InstanceType(
-                    self.node.try_get_context("eks_node_instance_type"))]
-
             # Worker Role
             worker_role = iam.Role(self, "EKSWorkerRole", role_name='eks-worker-role',
                                    assumed_by=iam.ServicePrincipal("ec2.amazonaws.com"))
@@ -204,24 +394,88 @@ class EKSClusterStack(Stack):
                                key_name="eshop-eks-ssh-key")
                 ssh_key = "eshop-eks-ssh-key"
 
-            eks_node_group = eks_cluster.add_nodegroup_capacity(
-                "cluster-default-ng",
-                capacity_type=node_capacity_type,
-                desired_size=self.node.try_get_context("eks_node_quantity"),
-                min_size=self.node.try_get_context("eks_node_quantity"),
-                max_size=self.node.try_get_context("eks_node_max_quantity"),
-                disk_size=self.node.try_get_context("eks_node_disk_size"),
-                labels={'role': 'worker'},
-                nodegroup_name='eks-node-group',
-                node_role=worker_role,
-                remote_access=eks.NodegroupRemoteAccess(
-                    ssh_key_name=ssh_key, source_security_groups=[ssh_worker_sg]),
-                # The default in CDK is to force upgrades through even if they violate - it is safer to not do that
-                force_update=False,
-                instance_types=instance_types,
-                release_version=self.node.try_get_context(
-                    "eks_node_ami_version"),
-            )
-            eks_node_group.role.add_managed_policy(
-                iam.ManagedPolicy.from_aws_managed_policy_name(
-                    "AmazonSSMManagedInstanceCore"))
+            node_groups = eks_node_group_specs(
+                self.node.try_get_context("eks_node_groups"))
+
+            node_groups_capacity = []
+
+            # One node group per spec, e.g. On-Demand for the latency critical APIs and
+            # tainted Spot for the background tasks, instead of the single default one
+            for name, spec in node_groups.items():
+                ami_type = spec.get("ami_type", EKS_NODE_ARCHITECTURES[eks_node_architecture(self)][1])
+                ami_arm = "ARM" in ami_type
+                node_group = eks_cluster.add_nodegroup_capacity(
+                    "cluster-" + name + "-ng",
+                    capacity_type=eks.CapacityType[spec.get("capacity_type", "ON_DEMAND")],
+                    desired_size=spec.get("desired_size", size.eks_node_quantity),
+                    min_size=spec.get("min_size", size.eks_node_quantity),
+                    max_size=spec.get("max_size", size.eks_node_max_quantity),
+                    disk_size=spec.get("disk_size", size.eks_node_disk_size),
+                    ami_type=eks.NodegroupAmiType[ami_type],
+                    labels={'role': 'worker', 'nodegroup': name, **spec.get("labels", {})},
+                    taints=[eks.TaintSpec(effect=eks.TaintEffect[taint["effect"]],
+                                          key=taint["key"], value=taint.get("value"))
+                            for taint in spec.get("taints", [])],
+                    nodegroup_name=eks_node_group_name(name),
+                    node_role=worker_role,
+                    remote_access=eks.NodegroupRemoteAccess(
+                        ssh_key_name=ssh_key, source_security_groups=[ssh_worker_sg]),
+                    force_update=False,
+                    instance_types=eks_instance_types(
+                        "eks_node_groups " + name,
+                        spec.get("instance_types", [size.eks_arm_node_instance_type if ami_arm
+                                                    else size.eks_node_instance_type]), ami_arm,
+                        prefix_delegation),
+                    # eks_node_ami_version is an Amazon Linux 2 release, the other AMI types have their own
+                    release_version=spec.get("release_version", self.node.try_get_context(
+                        "eks_node_ami_version") if ami_type.startswith("AL2") else None),
+                )
+                node_groups_capacity.append(node_group)
+
+            if not node_groups:
+                # Graviton (arm64) nodes take the arm64 Spot list and On-Demand instance type
+                arm = eks_node_architecture(self) == "arm64"
+                # If we enabled spot then use that
+                if self.node.try_get_context("eks_node_spot") == "True":
+                    node_capacity_type = eks.CapacityType.SPOT
+                    list_spot_instances = self.node.try_get_context(
+                        "eks_spot_arm_node_instance_type" if arm else "eks_spot_node_instance_type").split(',')
+                    instance_types = eks_instance_types(
+                        "eks_node_group", list_spot_instances, arm, prefix_delegation)
+                # Otherwise give us OnDemand
+                else:
+                    node_capacity_type = eks.CapacityType.ON_DEMAND
+                    instance_types = eks_instance_types(
+                        "eks_node_group",
+                        [size.eks_arm_node_instance_type if arm else size.eks_node_instance_type], arm,
+                        prefix_delegation)
+
+                eks_node_group = eks_cluster.add_nodegroup_capacity(
+                    "cluster-default-ng",
+                    capacity_type=node_capacity_type,
+                    desired_size=size.eks_node_quantity,
+                    min_size=size.eks_node_quantity,
+                    max_size=size.eks_node_max_quantity,
+                    disk_size=size.eks_node_disk_size,
+                    labels={'role': 'worker'},
+                    nodegroup_name='eks-node-group',
+                    ami_type=eks.NodegroupAmiType[EKS_NODE_ARCHITECTURES[eks_node_architecture(self)][1]],
+                    node_role=worker_role,
+                    remote_access=eks.NodegroupRemoteAccess(
+                        ssh_key_name=ssh_key, source_security_groups=[ssh_worker_sg]),
+                    # The default in CDK is to force upgrades through even if they violate - it is safer to not do that
+                    force_update=False,
+                    instance_types=instance_types,
+                    release_version=self.node.try_get_context(
+                        "eks_node_ami_version"),
+                )
+                eks_node_group.role.add_managed_policy(
+                    iam.ManagedPolicy.from_aws_managed_policy_name(
+                        "AmazonSSMManagedInstanceCore"))
+                node_groups_capacity.append(eks_node_group)
+
+            # EKS computes the max pods of managed nodes from the vpc-cni configuration when they
+            # launch, so the add-on has to be configured first
+            if vpc_cni_addon is not None:
+                for node_group in node_groups_capacity:
+                    node_group.node.add_dependency(vpc_cni_addon)
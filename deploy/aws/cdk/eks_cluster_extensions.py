@@ -3,7 +3,7 @@ Purpose
 
 Example of how to provision an EKS cluster, create the IAM Roles for Service Accounts (IRSA) mappings,
 and then deploy various common cluster add-ons (AWS Load Balancer Controller, ExternalDNS, EBS & EFS CSI Drivers,
-Cluster Autoscaler, AWS Managed OpenSearch and fluentbit, Metrics Server, Calico Network Policy provider,
+Cluster Autoscaler or Karpenter, AWS Managed OpenSearch and fluentbit, Metrics Server, Calico Network Policy provider,
 CloudWatch Container Insights, Security Groups for Pods, Kubecost, AWS Managed Prometheus and Grafana, etc.)
 
 NOTE: This pulls many parameters/options for what you'd like from the cdk.json context section.
@@ -14,12 +14,17 @@ from aws_cdk import (CfnJson, aws_ec2 as ec2, aws_eks as eks, aws_iam as iam,
                      aws_opensearchservice as opensearch, aws_logs as logs,
                      aws_certificatemanager as cm, CfnOutput,
                      RemovalPolicy, Stack, aws_route53 as route53,
+                     aws_sqs as sqs, aws_events as events,
+                     aws_events_targets as events_targets, Duration,
                      lambda_layer_kubectl_v28, Fn)
 from constructs import Construct
-import yaml
 
 from amp_custom_resource import AMPCustomResource
+from eks_cluster import (EKS_NODE_ARCHITECTURES, eks_max_pods, eks_node_architecture,
+                         eks_node_group_name, eks_node_group_specs, vpc_cni_env)
 from eks_worker_role_statements import EksWorkerRoleStatements
+from manifest_bundles import add_manifest_bundles
+from manifest_loader import load_manifests
 
 
 class EKSClusterStackExtensions(Stack):
@@ -53,6 +58,10 @@ class EKSClusterStackExtensions(Stack):
                                                               self, "KubectlLambdaRole", role_arn=eks_lambda_cluster_role_arn),
                                                           kubectl_role_arn=eks_cluster_master_role_arn)
 
+        # One-off step before the manifest bundles on an existing cluster, see manifest_bundles.py
+        retain_legacy_manifests = self.node.try_get_context(
+            "retain_legacy_manifests") == "True"
+
         # Create a Fargate Pod Execution Role to use with any Fargate Profiles
         # We create this explicitly to allow for logging without fargate_only_cluster=True
         fargate_pod_execution_role = iam.Role(
@@ -75,6 +84,26 @@ class EKSClusterStackExtensions(Stack):
             )
             return string
 
+        # The ENIConfigs of vpc-cni custom networking now come with the add-on in EKSClusterStack.
+        # retain_legacy_manifests keeps the former manifest once, retained, so removing it doesn't
+        # delete the ENIConfigs the add-on manages under the same names.
+        if (self.node.try_get_context("deploy_vpc_pod_cidr") == "True"
+                and retain_legacy_manifests):
+            eni_configs = [
+                {
+                    "apiVersion": "crd.k8s.amazonaws.com/v1alpha1",
+                    "kind": "ENIConfig",
+                    "metadata": {"name": private_subnet.availability_zone},
+                    "spec": {
+                        "subnet": Fn.import_value("VPCPodSubnet-" + private_subnet.availability_zone),
+                        "securityGroups": [Fn.import_value("EKSClusterSecurityGroupId")],
+                    },
+                }
+                for private_subnet in vpc.private_subnets
+            ]
+            eni_configs_manifest = eks_cluster.add_manifest("VpcPodEniConfigs", *eni_configs)
+            eni_configs_manifest.node.default_child.apply_removal_policy(RemovalPolicy.RETAIN)
+
         # AWS Load Balancer Controller
         if self.node.try_get_context("deploy_aws_lb_controller") == "True":
 
@@ -476,10 +505,14 @@ class EKSClusterStackExtensions(Stack):
             )
             externaldns_chart.node.add_dependency(externaldns_service_account)
 
-        # Cluster Autoscaler
+        # Cluster Autoscaler (Karpenter replaces it when deploy_karpenter is on)
         if (self.node.try_get_context("deploy_cluster_autoscaler") == "True"
+                and self.node.try_get_context("deploy_karpenter") != "True"
                 and self.node.try_get_context("fargate_only_cluster")
                 == "False"):
+            node_groups = eks_node_group_specs(
+                self.node.try_get_context("eks_node_groups"))
+
             clusterautoscaler_service_account = eks_cluster.add_service_account(
                 "clusterautoscaler",
                 name="clusterautoscaler",
@@ -496,6 +529,8 @@ class EKSClusterStackExtensions(Stack):
                     "autoscaling:DescribeTags",
                     "autoscaling:SetDesiredCapacity",
                     "autoscaling:TerminateInstanceInAutoScalingGroup",
+                    # Labels and taints of the managed node groups when scaling one up from zero
+                    "eks:DescribeNodegroup",
                 ],
                 "Resource":
                 "*",
@@ -530,12 +565,236 @@ class EKSClusterStackExtensions(Stack):
                     "extraArgs": {
                         "skip-nodes-with-system-pods": False,
                         "balance-similar-node-groups": True,
+                        **({"expander": "priority"} if node_groups else {}),
                     },
                 },
             )
             clusterautoscaler_chart.node.add_dependency(
                 clusterautoscaler_service_account)
 
+            # With several eks_node_groups, scale up the one with the highest priority that fits the
+            # pending pods, e.g. Spot before On-Demand for the background tasks
+            if node_groups:
+                priorities = {}
+                for name, spec in node_groups.items():
+                    priorities.setdefault(int(spec.get("priority", 10)), []).append(
+                        ".*" + eks_node_group_name(name) + "-.*")
+
+                clusterautoscaler_priorities = eks_cluster.add_manifest("ClusterAutoscalerPriorityExpander", {
+                    "apiVersion": "v1",
+                    "kind": "ConfigMap",
+                    "metadata": {
+                        "name": "cluster-autoscaler-priority-expander",
+                        "namespace": "kube-system"
+                    },
+                    "data": {
+                        "priorities": "".join(
+                            str(priority) + ":\n" + "".join("  - " + pattern + "\n" for pattern in patterns)
+                            for priority, patterns in sorted(priorities.items()))
+                    }
+                })
+                clusterautoscaler_chart.node.add_dependency(
+                    clusterautoscaler_priorities)
+
+        # Karpenter, launches right-sized EC2 capacity for pending pods directly instead of through an ASG
+        if (self.node.try_get_context("deploy_karpenter") == "True"
+                and self.node.try_get_context("fargate_only_cluster")
+                == "False"):
+            # Karpenter runs on the managed node group and launches its nodes with the same role,
+            # which the node group already mapped in aws-auth
+            if self.node.try_get_context("eks_deploy_managed_nodegroup") != "True":
+                raise ValueError("deploy_karpenter needs eks_deploy_managed_nodegroup")
+            karpenter_node_role = iam.Role.from_role_name(
+                self, "KarpenterNodeRole", "eks-worker-role")
+
+            # Spot interruptions, rebalance recommendations, scheduled maintenance and instance
+            # state changes, so Karpenter drains the node before EC2 takes it away
+            karpenter_interruption_queue = sqs.Queue(
+                self,
+                "KarpenterInterruptionQueue",
+                retention_period=Duration.minutes(5),
+                encryption=sqs.QueueEncryption.SQS_MANAGED)
+
+            karpenter_interruption_events = {
+                "KarpenterHealthEventRule": ("aws.health", "AWS Health Event"),
+                "KarpenterSpotInterruptionRule": ("aws.ec2", "EC2 Spot Instance Interruption Warning"),
+                "KarpenterRebalanceRule": ("aws.ec2", "EC2 Instance Rebalance Recommendation"),
+                "KarpenterInstanceStateChangeRule": ("aws.ec2", "EC2 Instance State-change Notification"),
+            }
+            for rule_id, (source, detail_type) in karpenter_interruption_events.items():
+                events.Rule(
+                    self,
+                    rule_id,
+                    event_pattern=events.EventPattern(
+                        source=[source], detail_type=[detail_type]),
+                    targets=[events_targets.SqsQueue(karpenter_interruption_queue)])
+
+            karpenter_service_account = eks_cluster.add_service_account(
+                "karpenter",
+                name="karpenter",
+                namespace="kube-system")
+
+            # Create the PolicyStatements to attach to the role
+            karpenter_policy_statement_json_1 = {
+                "Effect": "Allow",
+                "Action": [
+                    "ec2:CreateFleet",
+                    "ec2:CreateLaunchTemplate",
+                    "ec2:CreateTags",
+                    "ec2:DeleteLaunchTemplate",
+                    "ec2:DescribeAvailabilityZones",
+                    "ec2:DescribeImages",
+                    "ec2:DescribeInstances",
+                    "ec2:DescribeInstanceTypeOfferings",
+                    "ec2:DescribeInstanceTypes",
+                    "ec2:DescribeLaunchTemplates",
+                    "ec2:DescribeSecurityGroups",
+                    "ec2:DescribeSpotPriceHistory",
+                    "ec2:DescribeSubnets",
+                    "ec2:RunInstances",
+                    "ec2:TerminateInstances",
+                    "iam:AddRoleToInstanceProfile",
+                    "iam:CreateInstanceProfile",
+                    "iam:DeleteInstanceProfile",
+                    "iam:GetInstanceProfile",
+                    "iam:RemoveRoleFromInstanceProfile",
+                    "iam:TagInstanceProfile",
+                    "pricing:GetProducts",
+                ],
+                "Resource": "*",
+            }
+            karpenter_policy_statement_json_2 = {
+                "Effect": "Allow",
+                "Action": "ssm:GetParameter",
+                "Resource": f"arn:{self.partition}:ssm:{self.region}::parameter/aws/service/*",
+            }
+            karpenter_policy_statement_json_3 = {
+                "Effect": "Allow",
+                "Action": "iam:PassRole",
+                "Resource": karpenter_node_role.role_arn,
+            }
+            karpenter_policy_statement_json_4 = {
+                "Effect": "Allow",
+                "Action": "eks:DescribeCluster",
+                "Resource": eks_cluster.cluster_arn,
+            }
+            karpenter_policy_statement_json_5 = {
+                "Effect": "Allow",
+                "Action": [
+                    "sqs:DeleteMessage",
+                    "sqs:GetQueueUrl",
+                    "sqs:ReceiveMessage",
+                ],
+                "Resource": karpenter_interruption_queue.queue_arn,
+            }
+
+            # Attach the necessary permissions
+            for karpenter_policy_statement_json in [karpenter_policy_statement_json_1,
+                                                    karpenter_policy_statement_json_2,
+                                                    karpenter_policy_statement_json_3,
+                                                    karpenter_policy_statement_json_4,
+                                                    karpenter_policy_statement_json_5]:
+                karpenter_service_account.add_to_principal_policy(
+                    iam.PolicyStatement.from_json(karpenter_policy_statement_json))
+
+            # Install Karpenter
+            # For more info see https://karpenter.sh
+            karpenter_chart = eks_cluster.add_helm_chart(
+                "karpenter",
+                chart="karpenter",
+                version=self.node.try_get_context("karpenter_version"),
+                release="karpenter",
+                repository="oci://public.ecr.aws/karpenter/karpenter",
+                namespace="kube-system",
+                values={
+                    "settings": {
+                        "clusterName": eks_cluster.cluster_name,
+                        "interruptionQueue": karpenter_interruption_queue.queue_name,
+                    },
+                    "serviceAccount": {
+                        "create": False,
+                        "name": "karpenter"
+                    },
+                    "replicas": 2,
+                },
+            )
+            karpenter_chart.node.add_dependency(karpenter_service_account)
+
+            if self.node.try_get_context("vpc_only_public") == "True":
+                karpenter_subnets = vpc.public_subnets
+            else:
+                karpenter_subnets = vpc.private_subnets
+
+            # Default EC2NodeClass and NodePool, the same instance types and subnets as the managed
+            # node group, Spot first and On-Demand when Spot has no capacity
+            karpenter_node_class = {
+                "apiVersion": "karpenter.k8s.aws/v1beta1",
+                "kind": "EC2NodeClass",
+                "metadata": {"name": "default"},
+                "spec": {
+                    "amiFamily": "AL2",
+                    "role": "eks-worker-role",
+                    "subnetSelectorTerms": [{"id": subnet.subnet_id} for subnet in karpenter_subnets],
+                    "securityGroupSelectorTerms": [
+                        {"tags": {"aws:eks:cluster-name": eks_cluster.cluster_name}}],
+                },
+            }
+            karpenter_instance_types = self.node.try_get_context(
+                "eks_spot_arm_node_instance_type" if eks_node_architecture(self) == "arm64"
+                else "eks_spot_node_instance_type").split(',')
+
+            # Karpenter sizes max pods from the ENI limits, which undercounts nodes with prefix delegation
+            karpenter_kubelet = {}
+            if (self.node.try_get_context("deploy_vpc_cni_addon") == "True"
+                    and vpc_cni_env(self.node.try_get_context("vpc_cni_env"))[
+                        "ENABLE_PREFIX_DELEGATION"] == "true"):
+                karpenter_kubelet = {"kubelet": {
+                    "maxPods": eks_max_pods("Karpenter NodePool", karpenter_instance_types,
+                                            self.node.try_get_context("deploy_vpc_pod_cidr") == "True")}}
+
+            karpenter_node_pool = {
+                "apiVersion": "karpenter.sh/v1beta1",
+                "kind": "NodePool",
+                "metadata": {"name": "default"},
+                "spec": {
+                    "template": {
+                        "metadata": {"labels": {"role": "worker"}},
+                        "spec": {
+                            "nodeClassRef": {"name": "default"},
+                            **karpenter_kubelet,
+                            "requirements": [
+                                {
+                                    "key": "node.kubernetes.io/instance-type",
+                                    "operator": "In",
+                                    "values": karpenter_instance_types,
+                                },
+                                {
+                                    "key": "kubernetes.io/arch",
+                                    "operator": "In",
+                                    "values": [EKS_NODE_ARCHITECTURES[eks_node_architecture(self)][0]],
+                                },
+                                {
+                                    "key": "karpenter.sh/capacity-type",
+                                    "operator": "In",
+                                    "values": self.node.try_get_context(
+                                        "karpenter_capacity_types").split(','),
+                                },
+                            ],
+                        },
+                    },
+                    "limits": {
+                        "cpu": str(self.node.try_get_context("karpenter_cpu_limit"))
+                    },
+                    "disruption": {
+                        "consolidationPolicy": "WhenUnderutilized",
+                        "expireAfter": "720h",
+                    },
+                },
+            }
+            karpenter_node_pool_manifest = eks_cluster.add_manifest(
+                "KarpenterDefaultNodePool", karpenter_node_class, karpenter_node_pool)
+            karpenter_node_pool_manifest.node.add_dependency(karpenter_chart)
+
         # Amazon OpenSearch and a fluent-bit to ship our container logs there
         if self.node.try_get_context("deploy_managed_opensearch") == "True":
             # Create a new OpenSearch Domain
@@ -655,13 +914,15 @@ class EKSClusterStackExtensions(Stack):
 
         # Metrics Server (required for the Horizontal Pod Autoscaler (HPA))
         if self.node.try_get_context("deploy_metrics_server") == "True":
-            # For more info see https://github.com/bitnami/charts/tree/master/bitnami/metrics-server
+            # The upstream chart, its registry.k8s.io image is multi-arch unlike the Bitnami one of this
+            # version so it also runs on Graviton nodes
+            # For more info see https://github.com/kubernetes-sigs/metrics-server/tree/master/charts/metrics-server
             metricsserver_chart = eks_cluster.add_helm_chart(
                 "metrics-server",
                 chart="metrics-server",
-                version="6.2.6",
+                version="3.11.0",
                 release="metricsserver",
-                repository="https://charts.bitnami.com/bitnami",
+                repository="https://kubernetes-sigs.github.io/metrics-server/",
                 namespace="kube-system",
                 values={
                     "replicas": 2,
@@ -864,17 +1125,9 @@ class EKSClusterStackExtensions(Stack):
             )
 
             # Import cloudwatch-agent.yaml to a list of dictionaries and submit them as a manifest to EKS
-            # Read the YAML file
-            cw_agent_yaml_file = open("cloudwatch-agent.yaml", "r")
-            cw_agent_yaml = list(
-                yaml.load_all(cw_agent_yaml_file, Loader=yaml.FullLoader))
-            cw_agent_yaml_file.close()
-            loop_iteration = 0
-            for value in cw_agent_yaml:
-                # print(value)
-                loop_iteration = loop_iteration + 1
-                manifest_id = "CWAgent" + str(loop_iteration)
-                eks_cluster.add_manifest(manifest_id, value)
+            cw_agent_yaml = load_manifests("cloudwatch-agent.yaml")
+            add_manifest_bundles(eks_cluster, "CWAgent{}", cw_agent_yaml,
+                                 retain_legacy=retain_legacy_manifests)
 
         # CloudWatch Container Insights - Logs
         if (self.node.try_get_context(
@@ -1199,19 +1452,10 @@ class EKSClusterStackExtensions(Stack):
             amp_grafana_chart.node.add_dependency(amp_prometheus_chart)
 
             # Dashboards for Grafana from the grafana-dashboards.yaml file
-            grafana_dashboards_yaml_file = open(
-                "grafana-dashboards.yaml", "r")
-            grafana_dashboards_yaml = list(
-                yaml.load_all(grafana_dashboards_yaml_file,
-                              Loader=yaml.FullLoader))
-            grafana_dashboards_yaml_file.close()
-            loop_iteration = 0
-            for value in grafana_dashboards_yaml:
-                # print(value)
-                loop_iteration = loop_iteration + 1
-                manifest_id = "GrafanaDashboard" + str(loop_iteration)
-                grafana_dashboard_manifest = eks_cluster.add_manifest(
-                    manifest_id, value)
+            grafana_dashboards_yaml = load_manifests("grafana-dashboards.yaml")
+            add_manifest_bundles(
+                eks_cluster, "GrafanaDashboard{}", grafana_dashboards_yaml,
+                retain_legacy=retain_legacy_manifests)
 
         if self.node.try_get_context("deploy_loki") == "True":
 
@@ -1565,16 +1809,7 @@ class EKSClusterStackExtensions(Stack):
                              "account") + ':role/EshopEksForOidcSa'})
 
         # Deploy the manifests from service-accounts.yaml
-        service_accounts_yaml_file = open(
-            "service-accounts.yaml", "r")
-        service_accounts_yaml = list(
-            yaml.load_all(service_accounts_yaml_file,
-                          Loader=yaml.FullLoader))
-        service_accounts_yaml_file.close()
-        loop_iteration = 0
-        for value in service_accounts_yaml:
-            # print(value)
-            loop_iteration = loop_iteration + 1
-            manifest_id = "ServiceAccountsManifest" + \
-                str(loop_iteration)
-            manifest = eks_cluster.add_manifest(manifest_id, value)
+        service_accounts_yaml = load_manifests("service-accounts.yaml")
+        add_manifest_bundles(
+            eks_cluster, "ServiceAccountsManifest{}", service_accounts_yaml,
+            retain_legacy=retain_legacy_manifests)
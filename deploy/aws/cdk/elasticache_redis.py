@@ -1,10 +1,64 @@
 from constructs import Construct
+import json
 from aws_cdk import (
     aws_elasticache,
     aws_ec2 as ec2,
-    Stack
+    Stack,
+    CfnOutput,
+    Token
 )
 
+from sizing import sizing_profile
+
+
+def redis_parameter_group_family(engine_version):
+    # 7.x -> redis7, 6.x -> redis6.x, 5.0.6 -> redis5.0
+    major, minor = engine_version.split('.')[:2]
+    if int(major) >= 7:
+        return "redis" + major
+    if int(major) == 6:
+        return "redis6.x"
+    return "redis" + major + "." + minor
+
+
+# Defaults for a session/basket cache, overridden key by key with the redis_parameters context map
+REDIS_PARAMETER_DEFAULTS = {
+    # Only keys with a TTL are evicted, so baskets are never dropped to make room
+    "maxmemory-policy": "volatile-lru",
+    # Headroom for the replication and snapshot buffers
+    "reserved-memory-percent": "25",
+    # Detect dead peers quickly, but never close the long-lived pooled connections
+    "tcp-keepalive": "60",
+    "timeout": "0",
+    "activedefrag": "yes",
+}
+
+REDIS_MAXMEMORY_POLICIES = ["volatile-lru", "allkeys-lru", "volatile-lfu", "allkeys-lfu",
+                            "volatile-random", "allkeys-random", "volatile-ttl", "noeviction"]
+
+
+def redis_parameters(overrides):
+    # -c redis_parameters='{"timeout": "300"}' arrives as a string
+    if isinstance(overrides, str):
+        overrides = json.loads(overrides) if overrides.strip() else {}
+
+    parameters = dict(REDIS_PARAMETER_DEFAULTS)
+    parameters.update({key: str(value) for key, value in (overrides or {}).items()})
+
+    if parameters["maxmemory-policy"] not in REDIS_MAXMEMORY_POLICIES:
+        raise ValueError("redis_parameters maxmemory-policy must be one of " +
+                         ",".join(REDIS_MAXMEMORY_POLICIES))
+    if not 0 <= int(parameters["reserved-memory-percent"]) <= 100:
+        raise ValueError(
+            "redis_parameters reserved-memory-percent must be between 0 and 100")
+    if int(parameters["tcp-keepalive"]) < 0 or int(parameters["timeout"]) < 0:
+        raise ValueError(
+            "redis_parameters tcp-keepalive and timeout can't be negative")
+    if parameters["activedefrag"] not in ["yes", "no"]:
+        raise ValueError("redis_parameters activedefrag must be yes or no")
+
+    return parameters
+
 
 class ElastiCacheRedisStack(Stack):
 
@@ -12,6 +66,8 @@ class ElastiCacheRedisStack(Stack):
                  **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        size = sizing_profile(self)
+
         security_group = ec2.SecurityGroup(
             scope=self,
             id=f"RedisSecurityGroup",
@@ -41,14 +97,92 @@ class ElastiCacheRedisStack(Stack):
             description="subnet group for redis"
         )
 
-        if self.node.try_get_context("deploy_redis_as_replication_group") == "True":
-            cache_parameter_group_name = "default.redis5.0"
+        parameters = redis_parameters(
+            self.node.try_get_context("redis_parameters"))
+
+        def parameter_group(engine_version, extra_parameters=None):
+            return aws_elasticache.CfnParameterGroup(
+                scope=self,
+                id="RedisParameterGroup",
+                cache_parameter_group_family=redis_parameter_group_family(
+                    engine_version),
+                description="eshop-aws-redis tuned parameters",
+                properties=dict(parameters, **(extra_parameters or {})))
+
+        if self.node.try_get_context("deploy_redis_as_serverless") == "True":
+            # Serverless scales with the basket traffic up to the usage limits, it has no parameter group
+            engine_version = self.node.try_get_context("redis_engine_version")
+
+            redis_serverless = aws_elasticache.CfnServerlessCache(
+                scope=self,
+                id="EshopRedis",
+                engine="redis",
+                serverless_cache_name="eshop-aws-redis",
+                description="eshop-aws-redis serverless cache",
+                major_engine_version=engine_version.split('.')[0],
+                security_group_ids=[security_group.security_group_id],
+                subnet_ids=subnets_ids,
+                cache_usage_limits=aws_elasticache.CfnServerlessCache.CacheUsageLimitsProperty(
+                    data_storage=aws_elasticache.CfnServerlessCache.DataStorageProperty(
+                        maximum=size.redis_serverless_max_storage_gb,
+                        unit="GB"),
+                    ecpu_per_second=aws_elasticache.CfnServerlessCache.ECPUPerSecondProperty(
+                        maximum=size.redis_serverless_max_ecpu_per_second)))
+
+            CfnOutput(
+                self,
+                id="RedisServerlessEndpoint",
+                value=redis_serverless.attr_endpoint_address + ":" +
+                Token.as_string(redis_serverless.attr_endpoint_port),
+                description="The endpoint of the serverless Redis for the Basket API",
+                export_name="RedisServerlessEndpoint"
+            )
+        elif self.node.try_get_context("deploy_redis_as_cluster_mode") == "True":
+            # Cluster mode shards the keyspace so basket writes scale out across primaries
+            engine_version = self.node.try_get_context("redis_engine_version")
+            cache_parameter_group_name = parameter_group(
+                engine_version, {"cluster-enabled": "yes"}).ref
+
+            redis_replication = aws_elasticache.CfnReplicationGroup(self,
+                                                                    "EshopRedis",
+                                                                    replication_group_id="eshop-aws-redis",
+                                                                    replication_group_description="eshop-aws-cluster mode replication group",
+                                                                    cache_node_type=size.redis_replication_node_type,
+                                                                    cache_parameter_group_name=cache_parameter_group_name,
+                                                                    security_group_ids=[
+                                                                        security_group.security_group_id],
+                                                                    cache_subnet_group_name=cache_subnet_group.cache_subnet_group_name,
+                                                                    cluster_mode="enabled",
+                                                                    automatic_failover_enabled=True,
+                                                                    auto_minor_version_upgrade=True,
+                                                                    multi_az_enabled=size.redis_node_quantity > 0,
+                                                                    engine="redis",
+                                                                    engine_version=engine_version,
+                                                                    num_node_groups=size.redis_shard_quantity,
+                                                                    replicas_per_node_group=size.redis_node_quantity,
+                                                                    at_rest_encryption_enabled=True,
+                                                                    transit_encryption_enabled=True
+                                                                    )
+
+            redis_replication.add_dependency(cache_subnet_group)
+
+            CfnOutput(
+                self,
+                id="RedisConfigurationEndpoint",
+                value=redis_replication.attr_configuration_end_point_address + ":" +
+                redis_replication.attr_configuration_end_point_port,
+                description="The configuration endpoint of the cluster mode Redis for the Basket API",
+                export_name="RedisConfigurationEndpoint"
+            )
+        elif self.node.try_get_context("deploy_redis_as_replication_group") == "True":
+            engine_version = "5.0.6"
+            cache_parameter_group_name = parameter_group(engine_version).ref
 
             redis_replication = aws_elasticache.CfnReplicationGroup(self,
                                                                     "EshopRedis",
                                                                     replication_group_id="eshop-aws-redis",
                                                                     replication_group_description=f"eshop-aws-replication group",
-                                                                    cache_node_type="cache.t3.small",
+                                                                    cache_node_type=size.redis_replication_node_type,
                                                                     cache_parameter_group_name=cache_parameter_group_name,
                                                                     security_group_ids=[
                                                                         security_group.security_group_id],
@@ -57,21 +191,24 @@ class ElastiCacheRedisStack(Stack):
                                                                     auto_minor_version_upgrade=True,
                                                                     multi_az_enabled=True,
                                                                     engine="redis",
-                                                                    engine_version="5.0.6",
+                                                                    engine_version=engine_version,
                                                                     num_node_groups=1,
-                                                                    replicas_per_node_group=self.node.try_get_context(
-                                                                        "redis_node_quantity"),
+                                                                    replicas_per_node_group=size.redis_node_quantity,
                                                                     at_rest_encryption_enabled=True,
                                                                     transit_encryption_enabled=True
                                                                     )
 
             redis_replication.add_depends_on(cache_subnet_group)
         else:
+            engine_version = self.node.try_get_context("redis_engine_version")
+
             redis_cluster = aws_elasticache.CfnCacheCluster(
                 scope=self,
                 id="EshopRedis",
                 engine="redis",
-                cache_node_type="cache.t3.micro",
+                engine_version=engine_version,
+                cache_parameter_group_name=parameter_group(engine_version).ref,
+                cache_node_type=size.redis_node_type,
                 num_cache_nodes=1,
                 cluster_name="eshop-aws-redis",
                 vpc_security_group_ids=[security_group.security_group_id],
@@ -56,7 +56,7 @@ class IamOICProviderStack(Stack):
         oic_role.add_managed_policy(
             iam.ManagedPolicy.from_aws_managed_policy_name("AmazonDynamoDBFullAccess"))
 
-        if self.node.try_get_context("deploy_dynamodb") == "True":
+        if self.node.try_get_context("deploy_documentdb") == "True":
             amazon_doc_db_full_access = iam.ManagedPolicy.from_aws_managed_policy_name(
                 "AmazonDocDBFullAccess")
             oic_role.add_managed_policy(amazon_doc_db_full_access)
@@ -0,0 +1,70 @@
+"""
+Purpose
+
+Apply many Kubernetes manifests through a few kubectl custom resources instead of one per document.
+
+Every add_manifest call is its own CloudFormation resource and kubectl handler Lambda invocation,
+so the documents are grouped in order into multi-document manifests bounded by size.
+
+Each bundle takes the logical ID id_format.format(n), n being the 1-based position in the file of
+its first document. With the format of the former one manifest per document (e.g. "CWAgent{}"),
+every bundle updates the resource of its first document in place instead of replacing it.
+
+The resources of the other documents are removed from the template, and CloudFormation deleting
+them runs kubectl delete on objects the bundles have just applied. On an existing cluster deploy
+once with retain_legacy (the former one manifest per document, retained on removal) before
+switching to the bundles, so those resources are dropped without touching the cluster.
+"""
+
+import json
+
+from aws_cdk import RemovalPolicy
+
+# Keep each bundle well below the CloudFormation custom resource request size
+MAX_BUNDLE_BYTES = 128 * 1024
+
+
+def bundle_documents(documents, max_bytes=MAX_BUNDLE_BYTES):
+    return [[document for _, document in bundle]
+            for bundle in _bundle_positions(documents, max_bytes)]
+
+
+def _bundle_positions(documents, max_bytes):
+    bundles = []
+    bundle = []
+    bundle_bytes = 0
+
+    for position, document in enumerate(documents, start=1):
+        if document is None:  # empty documents, e.g. a trailing ---
+            continue
+        document_bytes = len(json.dumps(document))
+        if bundle and bundle_bytes + document_bytes > max_bytes:
+            bundles.append(bundle)
+            bundle = []
+            bundle_bytes = 0
+        bundle.append((position, document))
+        bundle_bytes += document_bytes
+
+    if bundle:
+        bundles.append(bundle)
+
+    return bundles
+
+
+def add_manifest_bundles(cluster, id_format, documents, max_bytes=MAX_BUNDLE_BYTES,
+                         retain_legacy=False):
+    manifests = []
+
+    if retain_legacy:
+        for position, document in enumerate(documents, start=1):
+            if document is None:
+                continue
+            manifest = cluster.add_manifest(id_format.format(position), document)
+            manifest.node.default_child.apply_removal_policy(RemovalPolicy.RETAIN)
+            manifests.append(manifest)
+        return manifests
+
+    for bundle in _bundle_positions(documents, max_bytes):
+        manifests.append(cluster.add_manifest(
+            id_format.format(bundle[0][0]), *[document for _, document in bundle]))
+    return manifests
@@ -0,0 +1,59 @@
+"""
+Purpose
+
+Load the multi-document YAML manifests shipped next to the stacks (cloudwatch-agent.yaml,
+grafana-dashboards.yaml, service-accounts.yaml).
+
+Paths are resolved relative to this folder rather than the working directory, libyaml's C loader
+is used when PyYAML was built with it and the parsed documents are cached as JSON in
+.manifest-cache keyed by the SHA-256 of the file, so repeated synths skip the YAML parse.
+"""
+
+import hashlib
+import json
+import os
+
+import yaml
+
+try:
+    Loader = yaml.CSafeLoader
+except AttributeError:
+    Loader = yaml.SafeLoader
+
+CDK_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(CDK_DIR, ".manifest-cache")
+
+_documents = {}
+
+
+def load_manifests(file_name):
+    with open(os.path.join(CDK_DIR, file_name), "rb") as f:
+        content = f.read()
+
+    digest = hashlib.sha256(content).hexdigest()
+    if digest in _documents:
+        return _documents[digest]
+
+    cache_file = os.path.join(CACHE_DIR, digest + ".json")
+    try:
+        with open(cache_file) as f:
+            documents = json.load(f)
+    except (OSError, ValueError):
+        documents = [document for document in yaml.load_all(content, Loader=Loader)
+                     if document is not None]
+        _write_cache(cache_file, documents)
+
+    _documents[digest] = documents
+    return documents
+
+
+def _write_cache(cache_file, documents):
+    # The cache is only an optimisation, a read-only checkout just parses every time
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        temp_file = cache_file + "." + str(os.getpid())
+        with open(temp_file, "w") as f:
+            json.dump(documents, f)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        pass
@@ -0,0 +1,88 @@
+"""
+Purpose
+
+Custom resource applying the runtime settings of the eShop event bus through the RabbitMQ
+management API, since Amazon MQ broker configurations only cover rabbitmq.conf: the default
+queue type of the / vhost, the queue policies and the channel limit of the broker user.
+
+The limits go in an operator policy, which applies on top of the user policy of a queue. The
+user policy (queue-mode) is only set when there is one, since on a cluster broker it would replace
+the Amazon MQ HA policy, and it is removed otherwise.
+
+Nothing is reverted on delete, the settings go away with the broker.
+"""
+
+import base64
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+def call(url, username, password, method, path, body=None):
+    request = urllib.request.Request(url + "/api/" + path,
+                                     data=json.dumps(body).encode() if body is not None else None,
+                                     method=method)
+    credentials = base64.b64encode((username + ":" + password).encode()).decode()
+    request.add_header("Authorization", "Basic " + credentials)
+    request.add_header("Content-Type", "application/json")
+    with urllib.request.urlopen(request, timeout=20) as response:
+        return response.status
+
+
+def put(url, username, password, path, body):
+    return call(url, username, password, "PUT", path, body)
+
+
+def delete(url, username, password, path):
+    try:
+        return call(url, username, password, "DELETE", path)
+    except urllib.error.HTTPError as error:
+        if error.code != 404:
+            raise
+        return error.code
+
+
+def handler(event, context):
+    properties = event["ResourceProperties"]
+    physical_id = "eshop-rabbitmq-policies"
+
+    if event["RequestType"] == "Delete":
+        return {"PhysicalResourceId": physical_id}
+
+    url = properties["ManagementUrl"]
+    username = properties["Username"]
+    password = properties["Password"]
+    vhost = urllib.parse.quote("/", safe="")
+
+    if properties.get("DefaultQueueType"):
+        put(url, username, password, "vhosts/" + vhost,
+            {"default_queue_type": properties["DefaultQueueType"]})
+
+    operator_policy = json.loads(properties.get("OperatorPolicy") or "{}")
+    if operator_policy:
+        put(url, username, password, "operator-policies/" + vhost + "/eshop-event-bus", {
+            "pattern": ".*",
+            "apply-to": "queues",
+            "priority": 0,
+            "definition": operator_policy,
+        })
+    else:
+        delete(url, username, password, "operator-policies/" + vhost + "/eshop-event-bus")
+
+    queue_policy = json.loads(properties.get("QueuePolicy") or "{}")
+    if queue_policy:
+        put(url, username, password, "policies/" + vhost + "/eshop-event-bus", {
+            "pattern": ".*",
+            "apply-to": "queues",
+            "priority": 0,
+            "definition": queue_policy,
+        })
+    else:
+        delete(url, username, password, "policies/" + vhost + "/eshop-event-bus")
+
+    put(url, username, password,
+        "user-limits/" + urllib.parse.quote(username, safe="") + "/max-channels",
+        {"value": int(properties["MaxChannels"])})
+
+    return {"PhysicalResourceId": physical_id}
@@ -1,9 +1,14 @@
+import json
+from dataclasses import replace
+
 from aws_cdk import (
     SecretValue,
     Stack,
     aws_rds as rds,
     aws_ec2 as ec2,
     aws_cloudwatch as cloudwatch,
+    aws_iam as iam,
+    aws_route53 as route53,
     aws_secretsmanager as secretsmanager,
     RemovalPolicy,
     Duration,
@@ -11,6 +16,133 @@ from aws_cdk import (
 
 from constructs import Construct
 
+from sizing import sizing_profile
+
+SQLSERVER_STORAGE_TYPES = ["standard", "gp2", "gp3", "io1", "io2"]
+
+# Limits of RDS for SQL Server, so a bad combination fails the synth instead of the deploy
+SQLSERVER_MAX_STORAGE = 16384
+SQLSERVER_MAX_IOPS = 64000
+SQLSERVER_MAX_THROUGHPUT = 4000
+SQLSERVER_MAX_IOPS_PER_GB = {"io1": 50, "io2": 1000}
+
+
+def sqlserver_storage(size):
+    # Returns the storage arguments shared by the primary and the read replicas
+    storage_type = size.rds_sqlserver_storage_type.lower()
+    iops = size.rds_sqlserver_iops
+    throughput = size.rds_sqlserver_storage_throughput
+    allocated = size.rds_sqlserver_allocated_storage
+
+    if storage_type not in SQLSERVER_STORAGE_TYPES:
+        raise ValueError("rds_sqlserver_storage_type must be one of " +
+                         ",".join(SQLSERVER_STORAGE_TYPES))
+    if not 20 <= allocated <= SQLSERVER_MAX_STORAGE:
+        raise ValueError("rds_sqlserver_allocated_storage must be between 20 and " +
+                         str(SQLSERVER_MAX_STORAGE) + " GB")
+    if size.rds_sqlserver_max_allocated_storage < allocated:
+        raise ValueError(
+            "rds_sqlserver_max_allocated_storage can't be lower than rds_sqlserver_allocated_storage")
+
+    if storage_type in ["standard", "gp2"]:
+        if iops or throughput:
+            raise ValueError("rds_sqlserver_iops and rds_sqlserver_storage_throughput need gp3, io1 or io2 storage")
+    elif storage_type == "gp3":
+        # 0 keeps the gp3 baseline of 3000 IOPS and 125 MB/s
+        if iops and not 3000 <= iops <= SQLSERVER_MAX_IOPS:
+            raise ValueError("rds_sqlserver_iops must be between 3000 and " +
+                             str(SQLSERVER_MAX_IOPS) + " on gp3")
+        if throughput and not 125 <= throughput <= SQLSERVER_MAX_THROUGHPUT:
+            raise ValueError("rds_sqlserver_storage_throughput must be between 125 and " +
+                             str(SQLSERVER_MAX_THROUGHPUT) + " MB/s on gp3")
+        if throughput and throughput > (iops or 3000) / 4:
+            raise ValueError("rds_sqlserver_storage_throughput can't exceed rds_sqlserver_iops / 4 MB/s on gp3")
+    else:
+        if not 1000 <= iops <= SQLSERVER_MAX_IOPS:
+            raise ValueError("rds_sqlserver_iops must be between 1000 and " +
+                             str(SQLSERVER_MAX_IOPS) + " on " + storage_type)
+        if iops > allocated * SQLSERVER_MAX_IOPS_PER_GB[storage_type]:
+            raise ValueError("rds_sqlserver_iops can't exceed " + str(SQLSERVER_MAX_IOPS_PER_GB[storage_type]) +
+                             " per GB of rds_sqlserver_allocated_storage on " + storage_type)
+        if throughput:
+            raise ValueError("rds_sqlserver_storage_throughput is only configurable on gp3")
+
+    return {
+        # rds.StorageType has no io2 yet, so io2 is created as io1 and overridden with use_io2
+        "storage_type": rds.StorageType.IO1 if storage_type == "io2" else rds.StorageType[storage_type.upper()],
+        "iops": iops or None,
+        "storage_throughput": throughput or None,
+    }
+
+
+RDS_MONITORING_INTERVALS = [0, 1, 5, 10, 15, 30, 60]
+
+
+def performance_insight_retention(months):
+    # 0 is the free 7 days, 1 to 23 months, 24 is the 2 years long term retention
+    if months == 0:
+        return rds.PerformanceInsightRetention.DEFAULT
+    if months == 24:
+        return rds.PerformanceInsightRetention.LONG_TERM
+    if 1 <= months <= 23:
+        return rds.PerformanceInsightRetention["MONTHS_" + str(months)]
+    raise ValueError("rds_performance_insights_retention_months must be between 0 and 24")
+
+
+SQLSERVER_SERVICE_SPEC_KEYS = ["instance_type", "allocated_storage", "max_allocated_storage", "replicas"]
+
+
+def sqlserver_service_instances(services):
+    # -c rds_sqlserver_service_instances='{"catalog": {"instance_type": "m5.large"}}' arrives as a string
+    if isinstance(services, str):
+        services = json.loads(services) if services.strip() else {}
+
+    for service, spec in (services or {}).items():
+        if not service.isalnum():
+            raise ValueError("rds_sqlserver_service_instances service names must be alphanumeric, not " + service)
+        unknown = [key for key in spec if key not in SQLSERVER_SERVICE_SPEC_KEYS]
+        if unknown:
+            raise ValueError("rds_sqlserver_service_instances " + service + " has unknown keys " +
+                             ",".join(unknown) + ", valid ones are " + ",".join(SQLSERVER_SERVICE_SPEC_KEYS))
+
+    return services or {}
+
+
+# OLTP defaults, overridden key by key with the rds_sqlserver_parameters context map
+SQLSERVER_PARAMETER_DEFAULTS = {
+    # Short transactional queries don't gain from parallel plans, they only contend for the workers
+    "max degree of parallelism": "2",
+    "cost threshold for parallelism": "50",
+    # Cache a plan stub on the first run of an ad hoc query so the plan cache doesn't bloat
+    "optimize for ad hoc workloads": "1",
+    # 75% of the instance memory in MB, the rest is left to the OS and RDS agents
+    "max server memory (mb)": "{DBInstanceClassMemory/1398102}",
+}
+
+
+def sqlserver_parameters(overrides):
+    # -c rds_sqlserver_parameters='{"max degree of parallelism": "4"}' arrives as a string
+    if isinstance(overrides, str):
+        overrides = json.loads(overrides) if overrides.strip() else {}
+
+    parameters = dict(SQLSERVER_PARAMETER_DEFAULTS)
+    parameters.update({key: str(value) for key, value in (overrides or {}).items()})
+
+    if not 0 <= int(parameters["max degree of parallelism"]) <= 32767:
+        raise ValueError(
+            "rds_sqlserver_parameters max degree of parallelism must be between 0 and 32767")
+    if not 0 <= int(parameters["cost threshold for parallelism"]) <= 32767:
+        raise ValueError(
+            "rds_sqlserver_parameters cost threshold for parallelism must be between 0 and 32767")
+    if parameters["optimize for ad hoc workloads"] not in ["0", "1"]:
+        raise ValueError("rds_sqlserver_parameters optimize for ad hoc workloads must be 0 or 1")
+
+    return parameters
+
+
+def use_io2(db_instance):
+    db_instance.node.default_child.add_property_override("StorageType", "io2")
+
 
 class RDSSQLServerStack(Stack):
 
@@ -18,6 +150,8 @@ class RDSSQLServerStack(Stack):
                  **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        size = sizing_profile(self)
+
         # db_password = secretsmanager.Secret(
         #     self,
         #     "sqlServerPwd",
@@ -27,8 +161,12 @@ class RDSSQLServerStack(Stack):
 
         db_user = "adminuser"
 
+        # Username and password as JSON, which is the format RDS Proxy reads the credentials in
         db_password = secretsmanager.Secret(self, "sqlserverCredentials",
-                                            secret_string_value=SecretValue("PAssw0rd"))
+                                            secret_object_value={
+                                                "username": SecretValue.unsafe_plain_text(db_user),
+                                                "password": SecretValue("PAssw0rd")
+                                            })
 
         db_security_group = ec2.SecurityGroup(self,
                                               "SQLServerSecurityGroup",
@@ -69,19 +207,87 @@ class RDSSQLServerStack(Stack):
                                           vpc_subnets=vpc_subnet
                                           )
 
+        if self.node.try_get_context("deploy_rds_sqlserver_as_cluster") == "False":
+            storage_size = size
+        else:
+            # The cluster used to get the 100 GB default of CDK and RDS can't shrink the storage,
+            # so it has its own allocated storage instead of the one of the single instance
+            storage_size = replace(
+                size,
+                rds_sqlserver_allocated_storage=size.rds_sqlserver_cluster_allocated_storage,
+                rds_sqlserver_max_allocated_storage=size.rds_sqlserver_cluster_max_allocated_storage)
+        storage = sqlserver_storage(storage_size)
+
+        # Performance Insights and Enhanced Monitoring, shared by the primary and the read replicas
+        monitoring = {}
+        if self.node.try_get_context("deploy_rds_performance_insights") == "True":
+            # Performance Insights runs with the RDS service-linked role
+            monitoring["enable_performance_insights"] = True
+            monitoring["performance_insight_retention"] = performance_insight_retention(
+                int(self.node.try_get_context("rds_performance_insights_retention_months")))
+
+        monitoring_interval = int(self.node.try_get_context("rds_monitoring_interval"))
+        if monitoring_interval not in RDS_MONITORING_INTERVALS:
+            raise ValueError("rds_monitoring_interval must be one of " +
+                             ",".join(str(interval) for interval in RDS_MONITORING_INTERVALS))
+        if monitoring_interval > 0:
+            monitoring["monitoring_interval"] = Duration.seconds(monitoring_interval)
+            monitoring["monitoring_role"] = iam.Role(
+                self,
+                "SQLServerMonitoringRole",
+                assumed_by=iam.ServicePrincipal("monitoring.rds.amazonaws.com"),
+                managed_policies=[iam.ManagedPolicy.from_aws_managed_policy_name(
+                    "service-role/AmazonRDSEnhancedMonitoringRole")])
+
+        if self.node.try_get_context("deploy_rds_sqlserver_as_cluster") == "False":
+            db_engine = rds.DatabaseInstanceEngine.sql_server_ex(
+                version=rds.SqlServerEngineVersion.VER_14_00_3465_1_V1)
+        else:
+            db_engine = rds.DatabaseInstanceEngine.sql_server_ee(
+                version=rds.SqlServerEngineVersion.VER_15)
+
+        # Parameter and option groups shared by every instance, primary, replicas and per-service
+        engine_groups = {
+            "parameter_group": rds.ParameterGroup(
+                self,
+                "SQLServerParameterGroup",
+                engine=db_engine,
+                description="OLTP parameters for eShop SQL Server",
+                parameters=sqlserver_parameters(
+                    self.node.try_get_context("rds_sqlserver_parameters")))
+        }
+
+        # e.g. {"SQLSERVER_BACKUP_RESTORE": {"IAM_ROLE_ARN": "arn:aws:iam::..."}}
+        sqlserver_options = self.node.try_get_context("rds_sqlserver_options")
+        if isinstance(sqlserver_options, str):
+            sqlserver_options = json.loads(sqlserver_options) if sqlserver_options.strip() else {}
+        if sqlserver_options:
+            engine_groups["option_group"] = rds.OptionGroup(
+                self,
+                "SQLServerOptionGroup",
+                engine=db_engine,
+                description="Options for eShop SQL Server",
+                configurations=[rds.OptionConfiguration(name=name, settings=settings or None)
+                                for name, settings in sqlserver_options.items()])
+
+        db_instances = []
+
         if self.node.try_get_context("deploy_rds_sqlserver_as_cluster") == "False":
 
             rds_db = rds.DatabaseInstance(
                 self,
                 "RDSQLServer",
-                engine=rds.DatabaseInstanceEngine.sql_server_ex(
-                    version=rds.SqlServerEngineVersion.VER_14_00_3465_1_V1),
+                engine=db_engine,
                 vpc=vpc,
                 credentials=rds.Credentials.from_password(
-                    db_user, db_password.secret_value),
-                instance_type=ec2.InstanceType('t2.micro'),
-                allocated_storage=20,  # Storage size in GB
-                max_allocated_storage=100,  # Maximum storage size (optional)
+                    db_user, db_password.secret_value_from_json("password")),
+                instance_type=ec2.InstanceType(
+                    size.rds_sqlserver_instance_type),
+                allocated_storage=size.rds_sqlserver_allocated_storage,  # Storage size in GB
+                max_allocated_storage=size.rds_sqlserver_max_allocated_storage,  # Maximum storage size (optional)
+                **storage,
+                **monitoring,
+                **engine_groups,
                 auto_minor_version_upgrade=False,
                 security_groups=[db_security_group],
                 subnet_group=db_subnet_group,
@@ -95,6 +301,8 @@ class RDSSQLServerStack(Stack):
                 cloudwatch_logs_exports=["error"]
             )
 
+            db_instances.append(rds_db)
+
             # Add alarm for high CPU
             cloudwatch.Alarm(self,
                              id="HighCPU",
@@ -115,15 +323,19 @@ class RDSSQLServerStack(Stack):
             rds_db = rds.DatabaseInstance(
                 self,
                 "RDSQLServer",
-                engine=rds.DatabaseInstanceEngine.sql_server_ee(
-                    version=rds.SqlServerEngineVersion.VER_15),
+                engine=db_engine,
                 vpc=vpc,
                 multi_az=True,
                 publicly_accessible=db_public_access,
                 credentials=rds.Credentials.from_password(
-                    db_user, db_password.secret_value),
-                instance_type=ec2.InstanceType.of(ec2.InstanceClass.M5,
-                                                  ec2.InstanceSize.XLARGE),
+                    db_user, db_password.secret_value_from_json("password")),
+                instance_type=ec2.InstanceType(
+                    size.rds_sqlserver_cluster_instance_type),
+                allocated_storage=storage_size.rds_sqlserver_allocated_storage,
+                max_allocated_storage=storage_size.rds_sqlserver_max_allocated_storage,
+                **storage,
+                **monitoring,
+                **engine_groups,
                 license_model=rds.LicenseModel.LICENSE_INCLUDED,
                 security_groups=[db_security_group],
                 subnet_group=db_subnet_group,
@@ -133,6 +345,8 @@ class RDSSQLServerStack(Stack):
                 cloudwatch_logs_exports=["error"]
             )
 
+            db_instances.append(rds_db)
+
             # Add alarm for high CPU
             cloudwatch.Alarm(self,
                              id="HighCPU",
@@ -140,14 +354,137 @@ class RDSSQLServerStack(Stack):
                              threshold=90,
                              evaluation_periods=1)
 
-            replica_db1 = rds.DatabaseInstanceReadReplica(
+            # The primary counts as one node, the rest are read replicas spread over the
+            # rds_sqlserver_replica_azs (or wherever RDS places them when it's empty)
+            replica_azs = [az.strip() for az in self.node.try_get_context(
+                "rds_sqlserver_replica_azs").split(',') if az.strip() != ""]
+            for az in replica_azs:
+                if az not in vpc.availability_zones:
+                    raise ValueError("rds_sqlserver_replica_azs " + az + " is not one of the VPC AZs " +
+                                     ",".join(vpc.availability_zones))
+
+            replicas = []
+            for index in range(1, size.rds_sqlserver_node_quantity):
+                replica_db = rds.DatabaseInstanceReadReplica(
+                    self,
+                    "RDSReadReplica" + str(index),
+                    source_database_instance=rds_db,
+                    vpc=vpc,
+                    publicly_accessible=db_public_access,
+                    instance_type=ec2.InstanceType(
+                        size.rds_sqlserver_replica_instance_type),
+                    availability_zone=replica_azs[(index - 1) % len(replica_azs)] if replica_azs else None,
+                    max_allocated_storage=storage_size.rds_sqlserver_max_allocated_storage,
+                    **storage,
+                    **monitoring,
+                    **engine_groups,
+                    security_groups=[db_security_group],
+                    subnet_group=db_subnet_group,
+                    vpc_subnets=vpc_subnet,
+                    deletion_protection=False,
+                    removal_policy=RemovalPolicy.DESTROY,
+                    cloudwatch_logs_exports=["error"]
+                )
+                replicas.append(replica_db)
+                db_instances.append(replica_db)
+
+                CfnOutput(
+                    self,
+                    id="RDSReadReplica" + str(index) + "Endpoint",
+                    value=replica_db.db_instance_endpoint_address,
+                    description="The endpoint of the RDS SQL Server read replica " + str(index),
+                    export_name="RDSSQLServerReadReplica" + str(index) + "Endpoint"
+                )
+
+            # One reader name for the Catalog API read queries, weighted evenly over the replicas
+            if self.node.try_get_context("deploy_rds_reader_dns") == "True" and replicas:
+                reader_zone = route53.PrivateHostedZone(
+                    self,
+                    "SQLServerReaderZone",
+                    zone_name=self.node.try_get_context("rds_reader_dns_zone_name"),
+                    vpc=vpc)
+
+                reader_name = self.node.try_get_context("rds_reader_dns_record_name") + \
+                    "." + self.node.try_get_context("rds_reader_dns_zone_name")
+
+                for index, replica_db in enumerate(replicas, start=1):
+                    # The L2 records don't support weighted routing in this CDK version
+                    route53.CfnRecordSet(
+                        self,
+                        "SQLServerReaderRecord" + str(index),
+                        hosted_zone_id=reader_zone.hosted_zone_id,
+                        name=reader_name,
+                        type="CNAME",
+                        ttl="60",
+                        set_identifier="replica" + str(index),
+                        weight=1,
+                        resource_records=[replica_db.db_instance_endpoint_address]
+                    )
+
+                CfnOutput(
+                    self,
+                    id="RDSSQLServerReaderEndpoint",
+                    value=reader_name,
+                    description="The weighted DNS name over the RDS SQL Server read replicas",
+                    export_name="RDSSQLServerReaderEndpoint"
+                )
+
+        # Isolated instances for the services of rds_sqlserver_service_instances, each with its own
+        # credentials, the services that aren't listed keep using the shared RDSQLServer instance
+        if self.node.try_get_context("deploy_rds_sqlserver_as_cluster") == "False":
+            service_mode = {
+                "multi_az": False,
+                "auto_minor_version_upgrade": False,
+                "delete_automated_backups": True,
+                "backup_retention": Duration.days(0),
+            }
+            service_instance_type = size.rds_sqlserver_instance_type
+        else:
+            service_mode = {
+                "multi_az": True,
+                "license_model": rds.LicenseModel.LICENSE_INCLUDED,
+            }
+            service_instance_type = size.rds_sqlserver_cluster_instance_type
+
+        service_instances = sqlserver_service_instances(
+            self.node.try_get_context("rds_sqlserver_service_instances"))
+
+        for service, spec in service_instances.items():
+            service_name = service.capitalize()
+            service_size = replace(
+                size,
+                rds_sqlserver_allocated_storage=int(spec.get(
+                    "allocated_storage", size.rds_sqlserver_allocated_storage)),
+                rds_sqlserver_max_allocated_storage=int(spec.get(
+                    "max_allocated_storage", size.rds_sqlserver_max_allocated_storage)))
+            service_replicas = int(spec.get("replicas", 0))
+            if service_replicas and self.node.try_get_context("deploy_rds_sqlserver_as_cluster") == "False":
+                raise ValueError("rds_sqlserver_service_instances " + service +
+                                 " replicas need deploy_rds_sqlserver_as_cluster")
+
+            service_password = secretsmanager.Secret(
+                self,
+                "sqlserver" + service_name + "Credentials",
+                generate_secret_string=secretsmanager.SecretStringGenerator(
+                    secret_string_template=json.dumps({"username": db_user}),
+                    generate_string_key="password",
+                    exclude_characters='/\\`"@;:|=][],'))
+
+            service_db = rds.DatabaseInstance(
                 self,
-                "RDSReadReplica1",
-                source_database_instance=rds_db,
+                "RDSQLServer" + service_name,
+                engine=db_engine,
+                **service_mode,
                 vpc=vpc,
                 publicly_accessible=db_public_access,
-                instance_type=ec2.InstanceType.of(ec2.InstanceClass.M5,
-                                                  ec2.InstanceSize.XLARGE),
+                credentials=rds.Credentials.from_secret(service_password),
+                instance_type=ec2.InstanceType(
+                    spec.get("instance_type", service_instance_type)),
+                allocated_storage=service_size.rds_sqlserver_allocated_storage,
+                max_allocated_storage=service_size.rds_sqlserver_max_allocated_storage,
+                **sqlserver_storage(service_size),
+                **monitoring,
+                **engine_groups,
                 security_groups=[db_security_group],
                 subnet_group=db_subnet_group,
                 vpc_subnets=vpc_subnet,
@@ -155,19 +492,137 @@ class RDSSQLServerStack(Stack):
                 removal_policy=RemovalPolicy.DESTROY,
                 cloudwatch_logs_exports=["error"]
             )
+            db_instances.append(service_db)
+
+            cloudwatch.Alarm(self,
+                             id="HighCPU" + service_name,
+                             metric=service_db.metric_cpu_utilization(),
+                             threshold=90,
+                             evaluation_periods=1)
+
+            CfnOutput(
+                self,
+                id="RDSQLServer" + service_name + "Endpoint",
+                value=service_db.db_instance_endpoint_address,
+                description="The endpoint of the RDS SQL Server instance of " + service,
+                export_name="RDSSQLServer" + service_name + "Endpoint"
+            )
+
+            CfnOutput(
+                self,
+                id="RDSQLServer" + service_name + "SecretArn",
+                value=service_password.secret_arn,
+                description="The credentials secret of the RDS SQL Server instance of " + service,
+                export_name="RDSSQLServer" + service_name + "SecretArn"
+            )
+
+            for index in range(1, service_replicas + 1):
+                service_replica_db = rds.DatabaseInstanceReadReplica(
+                    self,
+                    "RDSReadReplica" + service_name + str(index),
+                    source_database_instance=service_db,
+                    vpc=vpc,
+                    publicly_accessible=db_public_access,
+                    instance_type=ec2.InstanceType(
+                        spec.get("instance_type", size.rds_sqlserver_replica_instance_type)),
+                    max_allocated_storage=service_size.rds_sqlserver_max_allocated_storage,
+                    **sqlserver_storage(service_size),
+                    **monitoring,
+                    **engine_groups,
+                    security_groups=[db_security_group],
+                    subnet_group=db_subnet_group,
+                    vpc_subnets=vpc_subnet,
+                    deletion_protection=False,
+                    removal_policy=RemovalPolicy.DESTROY,
+                    cloudwatch_logs_exports=["error"]
+                )
+                db_instances.append(service_replica_db)
+
+                CfnOutput(
+                    self,
+                    id="RDSReadReplica" + service_name + str(index) + "Endpoint",
+                    value=service_replica_db.db_instance_endpoint_address,
+                    description="The endpoint of the RDS SQL Server read replica " + str(index) +
+                                " of " + service,
+                    export_name="RDSSQLServer" + service_name + "ReadReplica" + str(index) + "Endpoint"
+                )
+
+        if size.rds_sqlserver_storage_type.lower() == "io2":
+            for db_instance in db_instances:
+                use_io2(db_instance)
+
+        if self.node.try_get_context("deploy_rds_dashboard") == "True":
+            self.dashboard(db_instances, "enable_performance_insights" in monitoring)
+
+        # RDS Proxy pools the connections of the API pods so scale-outs don't storm the database
+        if self.node.try_get_context("deploy_rds_proxy") == "True":
 
-            replica_db2 = rds.DatabaseInstanceReadReplica(
+            db_proxy = rds.DatabaseProxy(
                 self,
-                "RDSReadReplica2",
-                source_database_instance=rds_db,
+                "RDSSQLServerProxy",
+                proxy_target=rds.ProxyTarget.from_instance(rds_db),
+                secrets=[db_password],
                 vpc=vpc,
-                publicly_accessible=db_public_access,
-                instance_type=ec2.InstanceType.of(ec2.InstanceClass.M5,
-                                                  ec2.InstanceSize.XLARGE),
-                security_groups=[db_security_group],
-                subnet_group=db_subnet_group,
                 vpc_subnets=vpc_subnet,
-                deletion_protection=False,
-                removal_policy=RemovalPolicy.DESTROY,
-                cloudwatch_logs_exports=["error"]
+                security_groups=[db_security_group],
+                db_proxy_name="eshop-sqlserver-proxy",
+                max_connections_percent=int(self.node.try_get_context(
+                    "rds_proxy_max_connections_percent")),
+                idle_client_timeout=Duration.seconds(
+                    int(self.node.try_get_context("rds_proxy_idle_client_timeout"))),
+                borrow_timeout=Duration.seconds(
+                    int(self.node.try_get_context("rds_proxy_borrow_timeout")))
+            )
+
+            CfnOutput(
+                self,
+                id="RDSSQLServerProxyEndpoint",
+                value=db_proxy.endpoint,
+                description="The endpoint of the RDS Proxy in front of SQL Server",
+                export_name="RDSSQLServerProxyEndpoint"
             )
+
+    def dashboard(self, db_instances, performance_insights):
+        # One line per instance (the primary first, then the read replicas) on every graph
+        def graph(title, metric_names, unit_label=None):
+            return cloudwatch.GraphWidget(
+                title=title,
+                width=12,
+                left=[db_instance.metric(metric_name,
+                                         label=db_instance.node.id + " " + metric_name,
+                                         period=Duration.minutes(1))
+                      for db_instance in db_instances
+                      for metric_name in metric_names],
+                left_y_axis=cloudwatch.YAxisProps(label=unit_label, min=0)
+            )
+
+        widgets = [
+            graph("Read/write IOPS", ["ReadIOPS", "WriteIOPS"], "Count/s"),
+            graph("Read/write latency", ["ReadLatency", "WriteLatency"], "Seconds"),
+            graph("Disk queue depth", ["DiskQueueDepth"]),
+            graph("Connections", ["DatabaseConnections"]),
+            graph("CPU", ["CPUUtilization"], "Percent"),
+            graph("Free storage and memory", ["FreeStorageSpace", "FreeableMemory"], "Bytes"),
+        ]
+
+        if performance_insights:
+            # DBLoadNonCPU is the load spent waiting, the wait events behind it are in the
+            # Performance Insights console of the instance
+            widgets.append(graph("DB load (CPU vs waits)",
+                                 ["DBLoad", "DBLoadCPU", "DBLoadNonCPU"], "Sessions"))
+
+        rds_dashboard = cloudwatch.Dashboard(
+            self,
+            "SQLServerDashboard",
+            dashboard_name="eshop-sqlserver"
+        )
+        for index in range(0, len(widgets), 2):
+            rds_dashboard.add_widgets(*widgets[index:index + 2])
+
+        CfnOutput(
+            self,
+            id="RDSSQLServerDashboard",
+            value=rds_dashboard.dashboard_name,
+            description="The CloudWatch dashboard of RDS SQL Server",
+            export_name="RDSSQLServerDashboard"
+        )
@@ -0,0 +1,225 @@
+"""
+Purpose
+
+Sizing profiles so the whole shop (EKS nodes, Redis, SQL Server, DocumentDB, DynamoDB and
+Amazon MQ) is resized coherently with the sizing_profile context value instead of stack by stack.
+
+Any field of SizingProfile can still be overridden on its own with a context value of the same
+name, e.g. -c sizing_profile=prod-small -c redis_node_quantity=2
+"""
+
+from dataclasses import dataclass, fields, replace
+
+
+@dataclass(frozen=True)
+class SizingProfile:
+    # EKS managed node group (On-Demand instance types, the Spot lists are eks_spot_node_instance_type
+    # and eks_spot_arm_node_instance_type)
+    eks_node_instance_type: str
+    eks_arm_node_instance_type: str  # eks_node_architecture arm64 only
+    eks_node_quantity: int
+    eks_node_max_quantity: int
+    eks_node_disk_size: int
+    # ElastiCache Redis, single node, replication group, cluster mode and serverless
+    redis_node_type: str
+    redis_replication_node_type: str
+    redis_node_quantity: int
+    redis_shard_quantity: int  # cluster mode only
+    redis_serverless_max_storage_gb: int  # serverless only
+    redis_serverless_max_ecpu_per_second: int  # serverless only
+    # RDS SQL Server, single instance (Express) and cluster (Enterprise) modes
+    rds_sqlserver_instance_type: str
+    rds_sqlserver_cluster_instance_type: str
+    rds_sqlserver_replica_instance_type: str  # cluster only
+    rds_sqlserver_node_quantity: int  # cluster only, the primary plus the read replicas
+    rds_sqlserver_allocated_storage: int
+    rds_sqlserver_max_allocated_storage: int
+    rds_sqlserver_cluster_allocated_storage: int  # cluster only, the primary and the read replicas
+    rds_sqlserver_cluster_max_allocated_storage: int  # cluster only
+    rds_sqlserver_storage_type: str
+    rds_sqlserver_iops: int  # 0 means the storage type's baseline
+    rds_sqlserver_storage_throughput: int  # 0 means the storage type's baseline
+    # DocumentDB
+    documentdb_instance_type: str
+    documentdb_quantity: int
+    documentdb_max_quantity: int  # replica autoscaling only
+    documentdb_elastic_shard_count: int  # elastic clusters only
+    documentdb_elastic_shard_capacity: int  # elastic clusters only, vCPUs per shard
+    # DynamoDB basket and session tables, provisioned capacity mode and DAX only
+    dynamodb_read_capacity: int
+    dynamodb_write_capacity: int
+    dynamodb_max_read_capacity: int
+    dynamodb_max_write_capacity: int
+    dynamodb_dax_node_type: str
+    dynamodb_dax_node_quantity: int
+    # Amazon MQ RabbitMQ, single instance and cluster modes
+    rabbitmq_instance_type: str
+    rabbitmq_cluster_instance_type: str
+
+
+SIZING_PROFILES = {
+    "dev": SizingProfile(
+        eks_node_instance_type="t3.medium",
+        eks_arm_node_instance_type="t4g.medium",
+        eks_node_quantity=2,
+        eks_node_max_quantity=4,
+        eks_node_disk_size=20,
+        redis_node_type="cache.t3.micro",
+        redis_replication_node_type="cache.t3.small",
+        redis_node_quantity=2,
+        redis_shard_quantity=2,
+        redis_serverless_max_storage_gb=1,
+        redis_serverless_max_ecpu_per_second=5000,
+        rds_sqlserver_instance_type="t2.micro",
+        rds_sqlserver_cluster_instance_type="m5.xlarge",
+        rds_sqlserver_replica_instance_type="m5.xlarge",
+        rds_sqlserver_node_quantity=3,
+        rds_sqlserver_allocated_storage=20,
+        rds_sqlserver_max_allocated_storage=100,
+        rds_sqlserver_cluster_allocated_storage=100,
+        rds_sqlserver_cluster_max_allocated_storage=200,
+        rds_sqlserver_storage_type="gp2",
+        rds_sqlserver_iops=0,
+        rds_sqlserver_storage_throughput=0,
+        documentdb_instance_type="r5.large",
+        documentdb_quantity=3,
+        documentdb_max_quantity=4,
+        documentdb_elastic_shard_count=2,
+        documentdb_elastic_shard_capacity=2,
+        dynamodb_read_capacity=5,
+        dynamodb_write_capacity=5,
+        dynamodb_max_read_capacity=50,
+        dynamodb_max_write_capacity=50,
+        dynamodb_dax_node_type="dax.t3.small",
+        dynamodb_dax_node_quantity=1,
+        rabbitmq_instance_type="mq.t3.micro",
+        rabbitmq_cluster_instance_type="mq.m5.large",
+    ),
+    "staging": SizingProfile(
+        eks_node_instance_type="t3.large",
+        eks_arm_node_instance_type="t4g.large",
+        eks_node_quantity=2,
+        eks_node_max_quantity=6,
+        eks_node_disk_size=30,
+        redis_node_type="cache.t3.small",
+        redis_replication_node_type="cache.t3.medium",
+        redis_node_quantity=2,
+        redis_shard_quantity=2,
+        redis_serverless_max_storage_gb=5,
+        redis_serverless_max_ecpu_per_second=20000,
+        rds_sqlserver_instance_type="t3.small",
+        rds_sqlserver_cluster_instance_type="m5.xlarge",
+        rds_sqlserver_replica_instance_type="m5.xlarge",
+        rds_sqlserver_node_quantity=3,
+        rds_sqlserver_allocated_storage=50,
+        rds_sqlserver_max_allocated_storage=200,
+        rds_sqlserver_cluster_allocated_storage=100,
+        rds_sqlserver_cluster_max_allocated_storage=200,
+        rds_sqlserver_storage_type="gp3",
+        rds_sqlserver_iops=0,
+        rds_sqlserver_storage_throughput=0,
+        documentdb_instance_type="r6g.large",
+        documentdb_quantity=3,
+        documentdb_max_quantity=4,
+        documentdb_elastic_shard_count=2,
+        documentdb_elastic_shard_capacity=4,
+        dynamodb_read_capacity=10,
+        dynamodb_write_capacity=10,
+        dynamodb_max_read_capacity=100,
+        dynamodb_max_write_capacity=100,
+        dynamodb_dax_node_type="dax.t3.medium",
+        dynamodb_dax_node_quantity=1,
+        rabbitmq_instance_type="mq.t3.micro",
+        rabbitmq_cluster_instance_type="mq.m5.large",
+    ),
+    "prod-small": SizingProfile(
+        eks_node_instance_type="m5.large",
+        eks_arm_node_instance_type="m6g.large",
+        eks_node_quantity=3,
+        eks_node_max_quantity=8,
+        eks_node_disk_size=50,
+        redis_node_type="cache.m6g.large",
+        redis_replication_node_type="cache.m6g.large",
+        redis_node_quantity=2,
+        redis_shard_quantity=2,
+        redis_serverless_max_storage_gb=10,
+        redis_serverless_max_ecpu_per_second=100000,
+        rds_sqlserver_instance_type="m5.large",
+        rds_sqlserver_cluster_instance_type="m5.xlarge",
+        rds_sqlserver_replica_instance_type="m5.xlarge",
+        rds_sqlserver_node_quantity=3,
+        rds_sqlserver_allocated_storage=100,
+        rds_sqlserver_max_allocated_storage=500,
+        rds_sqlserver_cluster_allocated_storage=100,
+        rds_sqlserver_cluster_max_allocated_storage=500,
+        rds_sqlserver_storage_type="gp3",
+        rds_sqlserver_iops=3000,
+        rds_sqlserver_storage_throughput=125,
+        documentdb_instance_type="r6g.large",
+        documentdb_quantity=3,
+        documentdb_max_quantity=6,
+        documentdb_elastic_shard_count=2,
+        documentdb_elastic_shard_capacity=8,
+        dynamodb_read_capacity=25,
+        dynamodb_write_capacity=25,
+        dynamodb_max_read_capacity=500,
+        dynamodb_max_write_capacity=500,
+        dynamodb_dax_node_type="dax.r5.large",
+        dynamodb_dax_node_quantity=3,
+        rabbitmq_instance_type="mq.m5.large",
+        rabbitmq_cluster_instance_type="mq.m5.large",
+    ),
+    "prod-large": SizingProfile(
+        eks_node_instance_type="m5.xlarge",
+        eks_arm_node_instance_type="m6g.xlarge",
+        eks_node_quantity=6,
+        eks_node_max_quantity=20,
+        eks_node_disk_size=100,
+        redis_node_type="cache.r6g.xlarge",
+        redis_replication_node_type="cache.r6g.xlarge",
+        redis_node_quantity=3,
+        redis_shard_quantity=4,
+        redis_serverless_max_storage_gb=50,
+        redis_serverless_max_ecpu_per_second=500000,
+        rds_sqlserver_instance_type="m5.xlarge",
+        rds_sqlserver_cluster_instance_type="r5.2xlarge",
+        rds_sqlserver_replica_instance_type="r5.xlarge",
+        rds_sqlserver_node_quantity=4,
+        rds_sqlserver_allocated_storage=500,
+        rds_sqlserver_max_allocated_storage=2000,
+        rds_sqlserver_cluster_allocated_storage=500,
+        rds_sqlserver_cluster_max_allocated_storage=2000,
+        rds_sqlserver_storage_type="gp3",
+        rds_sqlserver_iops=12000,
+        rds_sqlserver_storage_throughput=500,
+        documentdb_instance_type="r6g.xlarge",
+        documentdb_quantity=3,
+        documentdb_max_quantity=9,
+        documentdb_elastic_shard_count=4,
+        documentdb_elastic_shard_capacity=16,
+        dynamodb_read_capacity=100,
+        dynamodb_write_capacity=100,
+        dynamodb_max_read_capacity=4000,
+        dynamodb_max_write_capacity=4000,
+        dynamodb_dax_node_type="dax.r5.xlarge",
+        dynamodb_dax_node_quantity=3,
+        rabbitmq_instance_type="mq.m5.xlarge",
+        rabbitmq_cluster_instance_type="mq.m5.xlarge",
+    ),
+}
+
+
+def sizing_profile(scope) -> SizingProfile:
+    name = scope.node.try_get_context("sizing_profile") or "dev"
+    if name not in SIZING_PROFILES:
+        raise ValueError("Unknown sizing_profile " + name +
+                         ", valid ones are " + ",".join(SIZING_PROFILES))
+
+    # Context values passed with -c are strings, so convert them to the field's type
+    overrides = {}
+    for field in fields(SizingProfile):
+        value = scope.node.try_get_context(field.name)
+        if value is not None and value != "":
+            overrides[field.name] = field.type(value)
+
+    return replace(SIZING_PROFILES[name], **overrides)
@@ -0,0 +1,50 @@
+import os
+
+# Every stack of the app: name -> (module, class, stacks it needs).
+# Modules are only imported when their stack is going to be constructed, so a
+# targeted synth doesn't pay for the CloudFront asset staging or the EKS extensions.
+# VPCStack is passed in as the vpc argument, any other need becomes a stack dependency.
+STACKS = {
+    "Route53Stack": ("route53", "Route53Stack", []),
+    "CloudFrontS3Stack": ("cloudfront_s3", "CloudFrontS3Stack", []),
+    "VPCStack": ("vpc", "VpcStack", []),
+    "SQLServerStack": ("rds_sqlserver", "RDSSQLServerStack", ["VPCStack"]),
+    "EKSClusterStack": ("eks_cluster", "EKSClusterStack", ["VPCStack"]),
+    "EKSClusterStackExtensions": ("eks_cluster_extensions", "EKSClusterStackExtensions",
+                                  ["VPCStack", "EKSClusterStack"]),
+    "IamOICProviderStack": ("iam_oic_provider", "IamOICProviderStack", ["EKSClusterStack"]),
+    "ElasticCacheRedisStack": ("elasticache_redis", "ElastiCacheRedisStack", ["VPCStack"]),
+    "LambdaFunctionUrlStack": ("lambda_function_url", "LambdaFunctionUrlStack", []),
+    "DocumentDbStack": ("documentdb", "DocumentDbStack", ["VPCStack"]),
+    "DynamoDbStack": ("dynamodb", "DynamoDbStack", ["VPCStack"]),
+    "AmazonMQRabbitMQStack": ("amq_rabbitmq", "AmazonMQRabbitMQStack", ["VPCStack"]),
+    "SecretsManagerStack": ("secrets_manager", "SecretsManagerStack", []),
+    "WAFALBStack": ("waf_alb", "WAFALBStack", []),
+    "EKSCodeBuildStack": ("eks_codebuild", "EKSCodeBuildStack", []),
+}
+
+
+def selected_stacks(app):
+    # Either -c stacks=A,B or CDK_STACKS=A,B, nothing means the whole app
+    selection = app.node.try_get_context("stacks") or os.environ.get(
+        "CDK_STACKS", "")
+    names = [name.strip() for name in selection.split(',') if name.strip()]
+
+    if not names:
+        return list(STACKS)
+
+    unknown = [name for name in names if name not in STACKS]
+    if unknown:
+        raise ValueError("Unknown stacks " + ",".join(unknown) +
+                         ", valid ones are " + ",".join(STACKS))
+
+    # Pull in everything the requested stacks need
+    pending = list(names)
+    wanted = set()
+    while pending:
+        name = pending.pop()
+        if name not in wanted:
+            wanted.add(name)
+            pending.extend(STACKS[name][2])
+
+    return [name for name in STACKS if name in wanted]
@@ -0,0 +1,223 @@
+"""
+Purpose
+
+Benchmark the synth of every stack of app.py under a matrix of context profiles and fail when
+a change makes the templates of any of them bigger than the recorded baseline.
+
+The deterministic metrics (template and asset manifest bytes, resource counts) are always recorded
+and gated. The wall time and peak RSS depend on the machine, they are printed and only recorded
+and gated with --gate-resources, against a baseline recorded on the same machine and with a
+looser tolerance.
+
+The peak RSS comes from os.wait4, which only exists on POSIX. Elsewhere the synth runs through a
+plain subprocess.run and the peak RSS is not measured.
+
+Each (profile, stack) pair is synthesized in its own process with the stacks context value, so
+only the stack and the stacks it needs are built. The context is cdk.json overlaid with the
+stubbed lookups of benchmark/cdk.context.json and the profile from benchmark/profiles.json,
+which keeps the run fully offline.
+
+Usage:
+python synth_benchmark.py                       # compare against benchmark/baseline.json
+python synth_benchmark.py --update-baseline     # record a new baseline
+python synth_benchmark.py --profiles off --stacks ElasticCacheRedisStack,VPCStack
+python synth_benchmark.py --gate-resources --update-baseline --baseline local.json
+python synth_benchmark.py --gate-resources --baseline local.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from stack_registry import STACKS
+
+CDK_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_DIR = os.path.join(CDK_DIR, "benchmark")
+
+# CloudFormation hard limits, reported next to the numbers
+MAX_RESOURCES = 500
+MAX_TEMPLATE_BYTES = 1024 * 1024
+
+# Gated against the baseline, the same on every machine
+METRICS = ["template_bytes", "asset_manifest_bytes", "resources"]
+# Vary from one machine (and one run) to the next, only gated with --gate-resources
+RESOURCE_METRICS = ["wall_seconds", "peak_rss_kb"]
+
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def profile_context(profile):
+    context = load_json(os.path.join(CDK_DIR, "cdk.json"))["context"]
+    context.update(load_json(os.path.join(BENCHMARK_DIR, "cdk.context.json")))
+    context.update(load_json(os.path.join(BENCHMARK_DIR, "profiles.json"))[profile])
+    # The stubbed lookups are recorded for this account and region
+    context["account"] = "111111111111"
+    context["region"] = "eu-central-1"
+    return context
+
+
+def template_stats(out_dir, stack):
+    # The nested stacks (kubectl and cluster providers) are file assets of their parent stack
+    templates = [stack + ".template.json"]
+    asset_manifest = os.path.join(out_dir, stack + ".assets.json")
+    for asset in load_json(asset_manifest).get("files", {}).values():
+        if asset["source"]["path"].endswith(".nested.template.json"):
+            templates.append(asset["source"]["path"])
+
+    template_bytes = 0
+    resources = 0
+    for template in templates:
+        path = os.path.join(out_dir, template)
+        template_bytes += os.path.getsize(path)
+        resources += len(load_json(path).get("Resources", {}))
+
+    return {
+        "template_bytes": template_bytes,
+        "asset_manifest_bytes": os.path.getsize(asset_manifest),
+        "resources": resources,
+        "root_template_bytes": os.path.getsize(os.path.join(out_dir, templates[0])),
+        "root_resources": len(load_json(os.path.join(out_dir, templates[0])).get("Resources", {})),
+    }
+
+
+def synth(profile, stack):
+    context = profile_context(profile)
+    context["stacks"] = stack
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        env = dict(os.environ,
+                   CDK_CONTEXT_JSON=json.dumps(context),
+                   CDK_OUTDIR=out_dir)
+
+        start = time.perf_counter()
+        if hasattr(os, "wait4"):
+            process = subprocess.Popen([sys.executable, "app.py"], cwd=CDK_DIR, env=env,
+                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = process.stdout.read()
+            # wait4 gives the usage of this synth only, jsii's node process included
+            _, status, usage = os.wait4(process.pid, 0)
+            returncode = os.waitstatus_to_exitcode(status)
+            peak_rss_kb = usage.ru_maxrss
+        else:
+            process = subprocess.run([sys.executable, "app.py"], cwd=CDK_DIR, env=env,
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = process.stdout
+            returncode = process.returncode
+            peak_rss_kb = None
+        wall_seconds = time.perf_counter() - start
+
+        if returncode != 0:
+            raise RuntimeError("Synth of " + stack + " with profile " + profile +
+                               " failed:\n" + output.decode(errors="replace"))
+
+        missing = load_json(os.path.join(out_dir, "manifest.json")).get("missing", [])
+        if missing:
+            raise RuntimeError("Synth of " + stack + " with profile " + profile +
+                               " needs lookups missing from benchmark/cdk.context.json: " +
+                               ", ".join(m["key"] for m in missing))
+
+        result = {
+            "wall_seconds": round(wall_seconds, 2),
+            "peak_rss_kb": peak_rss_kb,
+        }
+        result.update(template_stats(out_dir, stack))
+        return result
+
+
+def regressions(results, baseline, thresholds):
+    found = []
+    for profile, stacks in results.items():
+        for stack, result in stacks.items():
+            previous = baseline.get(profile, {}).get(stack)
+            if previous is None:
+                continue
+            for metric, threshold in thresholds.items():
+                if previous.get(metric) is None or result[metric] is None:
+                    continue
+                if result[metric] > previous[metric] * (1 + threshold):
+                    found.append(f"{profile}/{stack}: {metric} {previous[metric]} -> {result[metric]}")
+    return found
+
+
+def limit_warnings(results):
+    found = []
+    for profile, stacks in results.items():
+        for stack, result in stacks.items():
+            if result["root_resources"] > MAX_RESOURCES * 0.8:
+                found.append(f"{profile}/{stack}: {result['root_resources']} of {MAX_RESOURCES} resources")
+            if result["root_template_bytes"] > MAX_TEMPLATE_BYTES * 0.8:
+                found.append(f"{profile}/{stack}: {result['root_template_bytes']} of {MAX_TEMPLATE_BYTES} template bytes")
+    return found
+
+
+def main():
+    profiles = list(load_json(os.path.join(BENCHMARK_DIR, "profiles.json")))
+
+    parser = argparse.ArgumentParser(description="Benchmark the synth of every stack")
+    parser.add_argument("--profiles", default=",".join(profiles),
+                        help="comma separated profiles of benchmark/profiles.json")
+    parser.add_argument("--stacks", default=",".join(STACKS),
+                        help="comma separated stacks of app.py")
+    parser.add_argument("--baseline", default=os.path.join(BENCHMARK_DIR, "baseline.json"))
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="record the results as the new baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="allowed growth of the template sizes and resource counts")
+    parser.add_argument("--gate-resources", action="store_true",
+                        help="also record and gate the wall time and peak RSS, only meaningful "
+                             "against a baseline recorded on the same machine")
+    parser.add_argument("--time-threshold", type=float, default=0.50,
+                        help="allowed growth of the wall time with --gate-resources")
+    parser.add_argument("--memory-threshold", type=float, default=0.25,
+                        help="allowed growth of the peak RSS with --gate-resources")
+    args = parser.parse_args()
+
+    thresholds = {metric: args.threshold for metric in METRICS}
+    if args.gate_resources:
+        thresholds.update(wall_seconds=args.time_threshold, peak_rss_kb=args.memory_threshold)
+
+    results = {}
+    for profile in args.profiles.split(','):
+        results[profile] = {}
+        for stack in args.stacks.split(','):
+            result = synth(profile, stack)
+            results[profile][stack] = result
+            peak_rss = "-" if result["peak_rss_kb"] is None else result["peak_rss_kb"] // 1024
+            print(f"{profile:6} {stack:28} {result['wall_seconds']:7.2f}s "
+                  f"{peak_rss:>6}MB {result['template_bytes']:9}B "
+                  f"{result['asset_manifest_bytes']:7}B {result['resources']:5} resources")
+
+    for warning in limit_warnings(results):
+        print("Close to the CloudFormation limits " + warning)
+
+    if args.update_baseline:
+        baseline = load_json(args.baseline) if os.path.exists(args.baseline) else {}
+        for profile, stacks in results.items():
+            baseline.setdefault(profile, {}).update(
+                {stack: {metric: value for metric, value in result.items()
+                         if args.gate_resources or metric not in RESOURCE_METRICS}
+                 for stack, result in stacks.items()})
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at " + args.baseline + ", run with --update-baseline first")
+        return 1
+
+    found = regressions(results, load_json(args.baseline), thresholds)
+    for regression in found:
+        print("Regression " + regression)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
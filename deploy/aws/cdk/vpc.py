@@ -1,5 +1,6 @@
-from aws_cdk import aws_ec2 as ec2, Stack, CfnOutput
+from aws_cdk import aws_ec2 as ec2, Stack, CfnOutput, CfnTag
 from constructs import Construct
+import ipaddress
 
 
 class VpcStack(Stack):
@@ -50,7 +51,55 @@ class VpcStack(Stack):
                     self.node.try_get_context("vpc_cidr")),
                 subnet_configuration=subnets_configuration
             )
+
+            # A secondary CIDR (100.64.0.0/16 by default) with one pod subnet per AZ for the vpc-cni custom
+            # networking ENIConfigs, the pods take their IPs there and only the nodes use the /22
+            if self.node.try_get_context("deploy_vpc_pod_cidr") == "True":
+                if self.node.try_get_context("vpc_only_public") == "True":
+                    raise ValueError("deploy_vpc_pod_cidr routes the pods through the private subnets, "
+                                     "it needs vpc_only_public set to False")
+
+                pod_cidr = ec2.CfnVPCCidrBlock(
+                    self,
+                    "PodCidr",
+                    vpc_id=self.vpc.vpc_id,
+                    cidr_block=self.node.try_get_context("vpc_pod_cidr"))
+
+                pod_subnet_cidrs = list(ipaddress.ip_network(
+                    self.node.try_get_context("vpc_pod_cidr")).subnets(
+                    new_prefix=int(self.node.try_get_context("vpc_pod_cidr_mask"))))
+                if len(pod_subnet_cidrs) < len(self.vpc.private_subnets):
+                    raise ValueError("vpc_pod_cidr_mask is too small to give each of the " +
+                                     str(len(self.vpc.private_subnets)) + " AZs a pod subnet")
+
+                for index, private_subnet in enumerate(self.vpc.private_subnets):
+                    pod_subnet = ec2.CfnSubnet(
+                        self,
+                        "PodSubnet" + str(index + 1),
+                        vpc_id=self.vpc.vpc_id,
+                        cidr_block=str(pod_subnet_cidrs[index]),
+                        availability_zone=private_subnet.availability_zone,
+                        tags=[CfnTag(key="Name", value=self.stack_name + "/VPC/PodSubnet" + str(index + 1))])
+                    pod_subnet.add_dependency(pod_cidr)
+
+                    # Same route table, so the same NAT gateway, as the private subnet of the AZ
+                    ec2.CfnSubnetRouteTableAssociation(
+                        self,
+                        "PodSubnet" + str(index + 1) + "RouteTableAssociation",
+                        subnet_id=pod_subnet.ref,
+                        route_table_id=private_subnet.route_table.route_table_id)
+
+                    CfnOutput(
+                        self,
+                        id="VPCPodSubnet" + str(index + 1),
+                        value=pod_subnet.ref,
+                        description="The pod subnet of " + private_subnet.availability_zone,
+                        export_name="VPCPodSubnet-" + private_subnet.availability_zone
+                    )
         else:
+            if self.node.try_get_context("deploy_vpc_pod_cidr") == "True":
+                raise ValueError("deploy_vpc_pod_cidr only works with create_new_vpc set to True")
+
             self.vpc = ec2.Vpc.from_lookup(
                 self,
                 "VPC",